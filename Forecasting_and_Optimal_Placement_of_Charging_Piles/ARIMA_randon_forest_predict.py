@@ -1,33 +1,138 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import numpy as np
-from statsmodels.tsa.arima.model import ARIMA
-from pmdarima import auto_arima
-from statsmodels.tsa.stattools import adfuller
-from prophet import Prophet
+from scipy import sparse
 from scipy.ndimage import gaussian_filter1d
-import libpysal.weights as weights
+from scipy.optimize import least_squares
 import os
+import json
+import time
+import signal
+import hashlib
+import threading
 import warnings
-from sklearn.linear_model import LinearRegression
-from typing import Dict, List, Any
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Any, Optional, Tuple
+from Forecast_result_storage import write_results
+from Province_config import PROVINCE_POLICY, PROVINCE_CAPACITY
+# statsmodels / pmdarima / prophet / libpysal 等在首次使用时由注册表加载
+from Model_registry import get_backend
 
 warnings.filterwarnings("ignore")
 
-# 配置参数
-PROVINCE_POLICY = {
-    '西藏': 1.5, '青海': 1.2, '宁夏': 1.1,
-    # 其他省份默认为1.0
+# 各省份公共充电桩保有量（台）
+PILE_DATA = {
+    "省份": ["北京", "天津", "河北", "山西", "内蒙古", "辽宁", "吉林", "黑龙江", 
+           "上海", "江苏", "浙江", "安徽", "福建", "江西", "山东", "河南", 
+           "湖北", "湖南", "广东", "广西", "海南", "重庆", "四川", "贵州", 
+           "云南", "西藏", "陕西", "甘肃", "青海", "宁夏", "新疆"],
+    "2016": [21940,6782,7307,3349,92,2520,47,82,16444,15869,5246,6756,2810,446,12340,2132,4266,2041,21108,393,365,2362,2986,282,412,9,1973,339,248,189,119],
+    "2017": [30363,9788,9875,5244,177,3184,259,579,26314,22075,9866,9909,5046,1357,17557,3702,6214,3655,29262,951,916,4949,4731,829,1429,9,3774,1226,340,199,124],
+    "2018": [41644,11209,11957,6500,1224,4280,733,1883,39303,30333,14226,10228,7942,2943,20798,8131,9722,5184,35928,1771,1403,8538,8169,1779,1987,17,8705,2327,445,233,207],
+    "2019": [59060,16687,22307,12027,2525,6044,1763,2666,55113,60509,29138,25754,17074,6744,32130,15968,17592,10498,62834,3596,3354,11245,14150,3207,3702,18,14857,3426,947,363,913],
+    "2020": [87634,27846,31804,19455,3490,8258,3768,4860,85538,77053,61542,38959,25926,11343,48890,32816,33408,18554,85874,7580,5813,17533,23872,4902,6004,193,25569,4377,1115,1510,1897],
+    "2021": [96840,33383,38491,25474,4500,10285,3811,7070,103249,97265,82041,58307,39853,15547,60251,43556,58627,27095,181846,14026,14042,20608,38312,9355,13600,391,34738,5637,1784,2190,3206],
+    "2022": [110145,46565,48950,33593,7696,12907,6810,9015,122235,129677,125918,84129,67299,26739,89965,68016,101163,41336,382960,33246,27596,38512,61416,20261,32146,557,48277,8088,2326,3329,4802]
 }
 
-PROVINCE_CAPACITY = {
-    '北京': 500000, '上海': 600000, '广东': 1000000,
-    '西藏': 100000, '青海': 150000, '宁夏': 200000,
-    # 其他省份默认容量
+# 省份邻接关系（用于空间权重）
+PROVINCE_ADJACENCY = {
+    "北京": ["天津", "河北"], "天津": ["北京", "河北"], 
+    "河北": ["北京", "天津", "山西", "内蒙古", "辽宁", "山东", "河南"],
+    "山西": ["河北", "内蒙古", "陕西", "河南"],
+    "内蒙古": ["河北", "山西", "陕西", "宁夏", "甘肃", "黑龙江", "吉林", "辽宁"],
+    "辽宁": ["河北", "内蒙古", "吉林"],
+    "吉林": ["辽宁", "内蒙古", "黑龙江"],
+    "黑龙江": ["吉林", "内蒙古"],
+    "上海": ["江苏", "浙江"],
+    "江苏": ["上海", "浙江", "安徽", "山东"],
+    "浙江": ["上海", "江苏", "安徽", "江西", "福建"],
+    "安徽": ["江苏", "浙江", "江西", "湖北", "河南", "山东"],
+    "福建": ["浙江", "江西", "广东"],
+    "江西": ["安徽", "浙江", "福建", "广东", "湖南", "湖北"],
+    "山东": ["河北", "河南", "安徽", "江苏"],
+    "河南": ["河北", "山西", "陕西", "湖北", "安徽", "山东"],
+    "湖北": ["河南", "陕西", "重庆", "湖南", "江西", "安徽"],
+    "湖南": ["湖北", "江西", "广东", "广西", "贵州", "重庆"],
+    "广东": ["福建", "江西", "湖南", "广西", "海南"],
+    "广西": ["湖南", "广东", "云南", "贵州"],
+    "海南": ["广东"],
+    "重庆": ["湖北", "湖南", "贵州", "四川", "陕西"],
+    "四川": ["重庆", "陕西", "甘肃", "青海", "西藏", "云南", "贵州"],
+    "贵州": ["重庆", "四川", "云南", "广西", "湖南"],
+    "云南": ["四川", "贵州", "广西", "西藏"],
+    "西藏": ["四川", "云南", "新疆", "青海"],
+    "陕西": ["山西", "内蒙古", "宁夏", "甘肃", "四川", "重庆", "湖北", "河南"],
+    "甘肃": ["内蒙古", "宁夏", "陕西", "四川", "青海", "新疆"],
+    "青海": ["甘肃", "四川", "西藏", "新疆"],
+    "宁夏": ["内蒙古", "陕西", "甘肃"],
+    "新疆": ["甘肃", "青海", "西藏"]
 }
 
+# 空间调整: 是否启用，邻域均值的混合权重，以及邻域数据来源（'latest' 最新年份 / 'forecast' 同一预测年份）
+# 原实现调用的 weights.Queen.from_adjacency 并不存在，总是退回空权重矩阵，空间调整从未生效；
+# 默认保持该输出不变，设为 True 时才按邻域均值混合（各省份预测会被拉向邻省最新保有量）
+SPATIAL_ADJUSTMENT = False
+SPATIAL_BLEND = 0.2
+SPATIAL_NEIGHBOR_SOURCE = 'latest'
+
+# 并行预测的进程数（<=1 时串行执行）
+FORECAST_WORKERS = 1
+
+# 预测方式: 'hybrid'（逐省份混合模型）或 'global'（所有省份共用一个面板模型，见 Global_panel_model）
+FORECAST_MODES = ('hybrid', 'global')
+FORECAST_MODE = 'hybrid'
+
+# 层级协调: None 表示不协调，否则为 Hierarchical_reconciliation.RECONCILIATION_METHODS 之一，
+# 将省份预测与全国 Chargers 预测协调为加总一致的结果
+RECONCILE_METHOD = None
+
+# auto_arima 阶数搜索设置（同时参与模型缓存键的计算）
+ARIMA_SEARCH_SETTINGS = {
+    'start_p': 0, 'max_p': 3,
+    'start_q': 0, 'max_q': 3,
+    'max_d': 1,
+    'seasonal': False,
+}
+
+# ARIMA 失败后的饱和增长层: 'logistic' 或 'gompertz'（最小二乘拟合，多省份向量化）
+SATURATING_MODEL = 'logistic'
+# 饱和增长拟合的最大允许误差（按容量上限归一化后的RMSE）
+SATURATING_MAX_RMSE = 0.02
+# 是否在饱和增长层失败后继续尝试 Prophet（与原级联一致默认开启；单省份拟合耗时较长，可关闭）
+USE_PROPHET = True
+
+# 时间预算（秒，None 表示不限时）: 各模型层、单个省份及整次运行；稳健增长层不计时
+TIER_TIME_BUDGET = {'arima': 30, 'saturating': 5, 'prophet': 60}
+PROVINCE_TIME_BUDGET = 90
+RUN_TIME_BUDGET = None
+
+# 概率预测: 模拟路径数（0 表示只输出点预测）、输出分位数及随机种子
+PROBABILISTIC_PATHS = 0
+PREDICTION_QUANTILES = (0.1, 0.5, 0.9)
+RANDOM_SEED = 42
+# 非ARIMA层抽样所用的最近年份数（历史增长率）
+GROWTH_SAMPLE_WINDOW = 4
+
+# 预测结果的输出格式（见 Forecast_result_storage.RESULT_FORMATS），下游脚本优先读取列式文件
+RESULT_FORMATS = ('parquet', 'xlsx')
+
+# 模型缓存目录及最大条目数（按最近访问时间LRU淘汰）
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "模型缓存")
+MODEL_CACHE_MAX_ENTRIES = 512
+# 表示数据不适用某一模型层的异常（平稳性/残差检验不通过、拟合或收敛失败），只有这类降级写入模型缓存；
+# 缺少依赖（ImportError）等环境或偶发错误与超时一样不缓存，下次运行重新尝试该层
+DATA_REJECTION_ERRORS = (ValueError, ArithmeticError, np.linalg.LinAlgError)
+
+# 增量更新: 是否启用，以及保存各省份上次所用模型的状态文件
+INCREMENTAL_UPDATE = False
+MODEL_STATE_PATH = os.path.join(MODEL_CACHE_DIR, "状态", "省份模型状态.json")
+
 def prepare_spatial_weights(provinces: List[str], adjacency: Dict[str, List[str]]) -> Any:
     """准备空间权重矩阵 - 修正版"""
+    weights = get_backend('spatial_weights')
     try:
         # 创建邻接字典
         adj_dict = {}
@@ -37,8 +142,8 @@ def prepare_spatial_weights(provinces: List[str], adjacency: Dict[str, List[str]
             valid_neighbors = [n for n in neighbors if n in provinces]
             adj_dict[province] = valid_neighbors
         
-        # 使用Queen邻接创建权重矩阵
-        w = weights.Queen.from_adjacency(adj_dict)
+        # 邻接字典即为Queen邻接关系，直接创建权重矩阵
+        w = weights.W(adj_dict, id_order=list(provinces), silence_warnings=True)
         return w
     except Exception as e:
         print(f"创建空间权重矩阵失败: {str(e)}")
@@ -81,225 +186,1083 @@ def spatial_adjustment(province: str,
         print(f"{province} 空间调整失败: {str(e)}")
         return value
 
-def preprocess_data(df: pd.DataFrame, province: str) -> pd.Series:
-    """数据预处理函数"""
+def spatial_weight_matrix(w: Any, provinces: List[str]) -> sparse.csr_matrix:
+    """
+    将空间权重矩阵转换为按 provinces 顺序排列的行标准化稀疏矩阵
+    参数:
+        w: libpysal 空间权重矩阵
+        provinces: 省份顺序
+    返回:
+        (省份数, 省份数) 稀疏矩阵，无邻接的省份对应全零行
+    """
+    n = len(provinces)
+    positions = {region: i for i, region in enumerate(w.id_order)}
+    rows = [i for i, province in enumerate(provinces) if province in positions]
+    if not rows:
+        return sparse.csr_matrix((n, n))
+    
+    # 选择矩阵: 将 w.id_order 顺序映射到 provinces 顺序
+    cols = [positions[provinces[i]] for i in rows]
+    select = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, len(w.id_order)))
+    matrix = select @ w.sparse.tocsr() @ select.T
+    
+    # 行标准化
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sums, out=np.zeros(n), where=row_sums > 0)
+    return sparse.diags(scale) @ matrix
+
+def spatial_adjustment_matrix(forecasts: np.ndarray,
+                              weight_matrix: sparse.csr_matrix,
+                              latest_values: Optional[np.ndarray] = None,
+                              blend: float = SPATIAL_BLEND,
+                              neighbor_source: str = SPATIAL_NEIGHBOR_SOURCE) -> np.ndarray:
+    """
+    矩阵形式的空间调整: 对全部省份、全部预测年份一次完成
+    参数:
+        forecasts: (省份数, 预测步数) 预测矩阵
+        weight_matrix: spatial_weight_matrix 返回的行标准化稀疏矩阵
+        latest_values: 各省份最新数据（与 forecasts 行顺序一致，缺失为 NaN），neighbor_source='latest' 时使用
+        blend: 邻域均值的权重，调整值为 (1-blend)*预测值 + blend*邻域均值
+        neighbor_source: 'latest' 使用最新年份数据，'forecast' 使用同一预测年份的邻域预测值
+    返回:
+        调整后的预测矩阵；无可用邻域数据或有效数据少于3个时保持原值
+    """
+    forecasts = np.asarray(forecasts, dtype=float)
+    if neighbor_source == 'latest':
+        reference = np.asarray(latest_values, dtype=float).reshape(-1, 1)
+    elif neighbor_source == 'forecast':
+        reference = forecasts
+    else:
+        raise ValueError(f"未知的邻域数据来源: {neighbor_source}")
+    
+    # 缺失数据不参与邻域均值
+    valid = ~np.isnan(reference)
+    neighbor_sum = weight_matrix @ np.where(valid, reference, 0.0)
+    neighbor_weight = weight_matrix @ valid.astype(float)
+    neighbor_avg = np.divide(neighbor_sum, neighbor_weight,
+                             out=np.zeros_like(neighbor_sum), where=neighbor_weight > 0)
+    
+    usable = (neighbor_weight > 0) & (valid.sum(axis=0) >= 3)
+    adjusted = (1 - blend) * forecasts + blend * neighbor_avg
+    return np.where(usable, adjusted, forecasts)
+
+VALUE_COLUMN = '公共充电桩保有量（台）'
+
+def data_years(df: pd.DataFrame) -> List[int]:
+    """数据覆盖的完整年份范围（首年至最新年份），df 可为长表或 build_panel 返回的宽表"""
+    years = df['年份'].astype(int) if '年份' in df.columns else pd.Index(df.columns).astype(int)
+    return list(range(years.min(), years.max() + 1))
+
+def build_panel(df: pd.DataFrame,
+                region_col: str = '省份',
+                year_col: str = '年份',
+                value_col: str = VALUE_COLUMN) -> pd.DataFrame:
+    """
+    长表 -> 地区 × 年份 宽表（一次分组完成）
+    返回:
+        行索引为排序后的地区名、列为完整年份（int）的 DataFrame，缺失为 NaN；
+        按地区取行为索引查找，无需对长表反复做布尔筛选
+    """
+    long_df = pd.DataFrame({
+        region_col: df[region_col].astype('category'),
+        year_col: df[year_col].astype(int),
+        value_col: pd.to_numeric(df[value_col], errors='coerce'),
+    })
+    panel = long_df.pivot_table(index=region_col, columns=year_col, values=value_col,
+                                aggfunc='last', observed=True, dropna=False)
+    panel.index = panel.index.astype(str)
+    years = long_df[year_col]
+    panel = panel.sort_index().reindex(columns=list(range(years.min(), years.max() + 1)))
+    panel.columns.name = year_col
+    return panel
+
+def load_panel(path: str,
+               region_col: str = '省份',
+               period_col: str = '年份',
+               value_col: str = VALUE_COLUMN,
+               agg: str = 'last',
+               chunksize: int = 1_000_000) -> pd.DataFrame:
+    """
+    分块读取大型 CSV/Parquet 长表并汇总为 地区 × 年份 宽表
+    参数:
+        path: .csv 或 .parquet 文件路径
+        region_col / period_col / value_col: 地区、时期（年份或 'YYYY-MM' 等以年份开头的时期）、数值列
+        agg: 'last' 取每年最后一期（保有量等存量指标），'sum' 取年内合计（新增量等流量指标）
+        chunksize: 每块行数
+    返回:
+        build_panel 格式的宽表；内存占用只与地区数 × 年份数有关，与原始行数无关
+    """
+    if agg not in ('last', 'sum'):
+        raise ValueError(f"未知的汇总方式: {agg}")
+    columns = [region_col, period_col, value_col]
+    year_key = '_年份'
+    order_key = '_期序'
+    
+    if path.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas(strings_to_categorical=True)
+                  for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns))
+    else:
+        chunks = pd.read_csv(path, usecols=columns, chunksize=chunksize,
+                             dtype={region_col: 'category', period_col: str})
+    
+    def reduce(frame: pd.DataFrame) -> pd.DataFrame:
+        """将长表汇总到 (地区, 年份) 粒度，结果保留时期序号以便跨块再次汇总"""
+        if agg == 'sum':
+            return frame.groupby([region_col, year_key], observed=True, as_index=False).agg(
+                {order_key: 'max', value_col: 'sum'})
+        return frame.sort_values(order_key, kind='stable').groupby([region_col, year_key], observed=True).tail(1)
+    
+    partials = []
+    for chunk in chunks:
+        if not isinstance(chunk[region_col].dtype, pd.CategoricalDtype):
+            chunk[region_col] = chunk[region_col].astype('category')
+        # 时期按 年 / 月 / 日 数值排序（'2023-9' 早于 '2023-12'），缺少的部分记为 0
+        periods = chunk.pop(period_col).astype(str)
+        parts = periods.str.extract(r'^(\d{4})\D*(\d{1,2})?\D*(\d{1,2})?').apply(pd.to_numeric)
+        if parts[0].isna().any():
+            raise ValueError(f"无法从时期解析年份: {periods[parts[0].isna()].iloc[0]}")
+        parts = parts.fillna(0).astype(int)
+        chunk[order_key] = parts[0] * 10000 + parts[1] * 100 + parts[2]
+        chunk[year_key] = parts[0]
+        partials.append(reduce(chunk))
+    
+    # 各块的地区类别不同，统一类别后再合并，合并结果仍为分类列
+    categories = pd.api.types.union_categoricals([p[region_col] for p in partials]).categories
+    for partial in partials:
+        partial[region_col] = partial[region_col].cat.set_categories(categories)
+    combined = reduce(pd.concat(partials, ignore_index=True))
+    panel = build_panel(combined, region_col=region_col, year_col=year_key, value_col=value_col)
+    panel.index.name = '省份'
+    panel.columns.name = '年份'
+    return panel
+
+def builtin_panel() -> pd.DataFrame:
+    """内置数据（PILE_DATA）对应的 省份 × 年份 宽表"""
+    return build_panel(pd.DataFrame(PILE_DATA).melt(
+        id_vars=["省份"],
+        var_name="年份",
+        value_name=VALUE_COLUMN
+    ))
+
+def preprocess_series(values: np.ndarray, years: List[int], province: str) -> pd.Series:
+    """
+    单个地区的数据预处理（输入为宽表中的一行）
+    参数:
+        values: 与 years 对应的观测值，缺失为 NaN
+        years: 完整年份范围
+        province: 省份名称
+    """
+    values = pd.Series(np.asarray(values, dtype=float))
+    
+    # 特殊处理西藏数据
+    if province == '西藏':
+        values = values.interpolate(method='linear')
+    
+    # 异常值处理
+    if not values.isnull().all():
+        q_low = values.quantile(0.05)
+        q_high = values.quantile(0.95)
+        values = np.clip(
+            values, 
+            q_low if not np.isnan(q_low) else 0, 
+            q_high if not np.isnan(q_high) else values.max()*2
+        )
+    
+    # 填充可能的缺失值
+    values = values.ffill().bfill()
+    
+    # 创建时间序列
+    dates = pd.date_range(start=f"{years[0]}-01-01", periods=len(years), freq='YS')
+    return pd.Series(values.values, index=dates)
+
+def preprocess_data(df: pd.DataFrame, province: str, years: Optional[List[int]] = None) -> pd.Series:
+    """
+    数据预处理函数
+    参数:
+        df: 长表数据
+        province: 省份名称
+        years: 时间范围，默认取数据中的首年至最新年份（新增年份数据后自动延长序列）
+    """
     try:
         # 确保完整的时间范围
-        full_years = pd.DataFrame({'年份': [str(y) for y in range(2016, 2023)]})
-        province_data = df[df['省份'] == province].copy()
-        province_data['年份'] = province_data['年份'].astype(str)
-        
-        merged = pd.merge(full_years, province_data, on='年份', how='left')
-        
-        # 特殊处理西藏数据
-        if province == '西藏':
-            merged['公共充电桩保有量（台）'] = merged['公共充电桩保有量（台）'].interpolate(method='linear')
-        
-        # 异常值处理
-        if not merged['公共充电桩保有量（台）'].isnull().all():
-            q_low = merged['公共充电桩保有量（台）'].quantile(0.05)
-            q_high = merged['公共充电桩保有量（台）'].quantile(0.95)
-            merged['公共充电桩保有量（台）'] = np.clip(
-                merged['公共充电桩保有量（台）'], 
-                q_low if not np.isnan(q_low) else 0, 
-                q_high if not np.isnan(q_high) else merged['公共充电桩保有量（台）'].max()*2
-            )
-        
-        # 填充可能的缺失值
-        merged['公共充电桩保有量（台）'] = merged['公共充电桩保有量（台）'].fillna(method='ffill').fillna(method='bfill')
-        
-        # 创建时间序列
-        dates = pd.date_range(start="2016-01-01", periods=7, freq='YS')
-        return pd.Series(merged['公共充电桩保有量（台）'].values, index=dates)
+        years = years or data_years(df)
+        panel = build_panel(df[df['省份'] == province]).reindex(columns=years)
+        values = panel.loc[province].values if province in panel.index else np.full(len(years), np.nan)
+        return preprocess_series(values, years, province)
     
     except Exception as e:
         print(f"预处理{province}数据时出错: {str(e)}")
         raise
 
-def hybrid_forecast(series: pd.Series, province: str, steps: int = 8) -> np.ndarray:
-    """混合预测模型"""
-    min_growth, max_growth = (0.10, 0.50) if province in ['西藏', '青海', '宁夏'] else (0.05, 0.30)
+def _growth_bounds(province: str):
+    """省份增长率上下限"""
+    return (0.10, 0.50) if province in ['西藏', '青海', '宁夏'] else (0.05, 0.30)
+
+def _model_cache_key(series: pd.Series, province: str) -> str:
+    """根据输入序列与模型设置计算缓存键"""
+    payload = {
+        'province': province,
+        'index': [str(d) for d in series.index],
+        'values': [float(v) for v in series.values],
+        'policy': PROVINCE_POLICY.get(province, 1.0),
+        'arima': ARIMA_SEARCH_SETTINGS,
+        'fallback': {'saturating': SATURATING_MODEL, 'prophet': USE_PROPHET},
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def load_cached_model(key: str, cache_dir: str = MODEL_CACHE_DIR) -> Optional[Dict[str, Any]]:
+    """读取模型缓存，命中时刷新访问时间（用于LRU淘汰）"""
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        os.utime(path, None)
+        return record
+    except (OSError, ValueError):
+        return None
+
+def save_cached_model(key: str,
+                      record: Dict[str, Any],
+                      cache_dir: str = MODEL_CACHE_DIR,
+                      max_entries: int = MODEL_CACHE_MAX_ENTRIES) -> None:
+    """写入模型缓存，超出条目上限时淘汰最久未访问的记录"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, f"{key}.json")
+        # 先写临时文件再替换，避免并行进程读到不完整的文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        
+        entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json')]
+        if len(entries) > max_entries:
+            entries.sort(key=os.path.getmtime)
+            for old_path in entries[:len(entries) - max_entries]:
+                os.remove(old_path)
+    except OSError as e:
+        print(f"写入模型缓存失败: {str(e)}")
+
+def _arima_search_forecast(series: pd.Series, steps: int):
+    """auto_arima 搜索阶数后拟合ARIMA，返回预测值与缓存记录"""
+    ARIMA, adfuller = get_backend('arima'), get_backend('adfuller')
+    model = get_backend('auto_arima')(
+        series,
+        suppress_warnings=True,
+        error_action='ignore',
+        trace=True,
+        **ARIMA_SEARCH_SETTINGS
+    )
+    arima_model = ARIMA(series, order=model.order)
+    arima_fit = arima_model.fit()
+    
+    if adfuller(arima_fit.resid)[1] > 0.05:
+        raise ValueError("残差非白噪声")
+    
+    record = {
+        'tier': 'arima',
+        'order': list(model.order),
+        'params': [float(v) for v in arima_fit.params],
+    }
+    return arima_fit.get_forecast(steps=steps).predicted_mean.values, record
+
+def _arima_warm_forecast(series: pd.Series, state: Dict[str, Any], steps: int):
+    """
+    增量更新: 沿用上次选定的阶数，以上次参数为初值重新拟合
+    残差诊断（ADF检验）不通过时抛出 ValueError，由调用方退回完整的阶数搜索
+    """
+    arima_model = get_backend('arima')(series, order=tuple(state['order']))
+    arima_fit = arima_model.fit(start_params=np.asarray(state['params']))
+    
+    if get_backend('adfuller')(arima_fit.resid)[1] > 0.05:
+        raise ValueError("沿用阶数后残差诊断退化")
     
+    record = {
+        'tier': 'arima',
+        'order': list(state['order']),
+        'params': [float(v) for v in arima_fit.params],
+    }
+    return arima_fit.get_forecast(steps=steps).predicted_mean.values, record
+
+def _arima_cached_forecast(series: pd.Series, record: Dict[str, Any], steps: int) -> np.ndarray:
+    """使用缓存的阶数和参数直接滤波预测，跳过阶数搜索与参数估计"""
+    arima_model = get_backend('arima')(series, order=tuple(record['order']))
+    arima_fit = arima_model.filter(np.asarray(record['params']))
+    return arima_fit.get_forecast(steps=steps).predicted_mean.values
+
+def _saturating_curve(params: np.ndarray, t: np.ndarray, model: str) -> np.ndarray:
+    """饱和增长曲线（按容量上限归一化），params 为 (省份数, 2)"""
+    a, b = params[:, :1], params[:, 1:]
+    if model == 'logistic':
+        # a: 增长速率 k, b: 拐点位置 t0
+        return 1.0 / (1.0 + np.exp(-a * (t - b)))
+    if model == 'gompertz':
+        # a: 位移 b, b: 增长速率 c
+        return np.exp(-a * np.exp(-b * t))
+    raise ValueError(f"未知的饱和增长模型: {model}")
+
+def saturating_growth_forecast(history: np.ndarray,
+                               caps: Any,
+                               steps: int = 8,
+                               model: str = SATURATING_MODEL,
+                               max_rmse: float = SATURATING_MAX_RMSE):
+    """
+    批量饱和增长预测（Logistic/Gompertz），所有省份在一次最小二乘中联合拟合
+    参数:
+        history: (省份数, 年数) 历史数据矩阵
+        caps: 每行的容量上限（与 Prophet 层相同: series.max()*3*政策系数）
+        steps: 预测步数
+        model: 'logistic' 或 'gompertz'
+        max_rmse: 归一化RMSE上限，超过则视为拟合失败
+    返回:
+        ((省份数, steps) 预测矩阵, 每行是否拟合成功的布尔数组)
+    说明:
+        与 Prophet 层一致，预测期容量上限按 linspace(1, 1.5) 逐年放宽
+    """
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    n_rows, n_obs = history.shape
+    caps = np.broadcast_to(np.asarray(caps, dtype=float), (n_rows,))
+    t = np.arange(n_obs, dtype=float)
+    y = np.clip(history / caps[:, None], 1e-4, 1 - 1e-4)
+    
+    # 线性化后按行最小二乘得到初值
+    if model == 'logistic':
+        z = np.log(y / (1 - y))
+    else:
+        z = np.log(-np.log(y))
+    t_c = t - t.mean()
+    slope = ((z - z.mean(axis=1, keepdims=True)) * t_c).sum(axis=1) / (t_c ** 2).sum()
+    intercept = z.mean(axis=1) - slope * t.mean()
+    if model == 'logistic':
+        rate = np.clip(slope, 1e-3, 5)
+        x0 = np.column_stack([rate, np.clip(-intercept / rate, -50, 50)])
+        lower, upper = [1e-3, -50], [5, 50]
+    else:
+        x0 = np.column_stack([np.clip(np.exp(intercept), 1e-6, 1e3), np.clip(-slope, 1e-3, 5)])
+        lower, upper = [1e-6, 1e-3], [1e3, 5]
+    
+    # 各省份参数互不相关，雅可比矩阵为块对角稀疏结构
+    sparsity = sparse.kron(sparse.eye(n_rows), np.ones((n_obs, 2)))
+    
+    def residuals(flat_params):
+        return (_saturating_curve(flat_params.reshape(n_rows, 2), t, model) - y).ravel()
+    
+    ok = np.zeros(n_rows, dtype=bool)
+    forecast = np.full((n_rows, steps), np.nan)
     try:
-        # 尝试ARIMA模型
-        model = auto_arima(
-            series,
-            start_p=0, max_p=3,
-            start_q=0, max_q=3,
-            max_d=1,
-            seasonal=False,
-            suppress_warnings=True,
-            error_action='ignore',
-            trace=True
+        result = least_squares(
+            residuals, x0.ravel(),
+            bounds=(np.tile(lower, n_rows), np.tile(upper, n_rows)),
+            jac_sparsity=sparsity,
+            method='trf'
         )
-        arima_model = ARIMA(series, order=model.order)
-        arima_fit = arima_model.fit()
-        
-        if adfuller(arima_fit.resid)[1] > 0.05:
-            raise ValueError("残差非白噪声")
-            
-        forecast = arima_fit.get_forecast(steps=steps).predicted_mean.values
-        
-    except Exception as arima_error:
-        print(f"{province} ARIMA失败: {str(arima_error)}. 尝试Prophet...")
-        
+    except Exception as e:
+        print(f"饱和增长拟合失败: {str(e)}")
+        return forecast, ok
+    
+    params = result.x.reshape(n_rows, 2)
+    rmse = np.sqrt(np.mean(result.fun.reshape(n_rows, n_obs) ** 2, axis=1))
+    t_future = np.arange(n_obs, n_obs + steps, dtype=float)
+    ramp = np.linspace(1, 1.5, n_obs + steps)[n_obs:]
+    forecast = caps[:, None] * ramp * _saturating_curve(params, t_future, model)
+    ok = np.isfinite(forecast).all(axis=1) & (rmse <= max_rmse)
+    return forecast, ok
+
+def _saturating_cap(series: pd.Series, province: str) -> float:
+    """饱和增长层与 Prophet 层共用的容量上限"""
+    return series.max() * 3 * PROVINCE_POLICY.get(province, 1.0)
+
+def batch_saturating_fits(values: np.ndarray,
+                          provinces: List[str],
+                          years: List[int],
+                          steps: int = 8) -> Dict[str, Tuple[np.ndarray, bool]]:
+    """
+    在逐省份级联之前，对所有省份的饱和增长层一次联合拟合
+    参数:
+        values: (省份数, 年数) 宽表数据，行顺序与 provinces 一致
+        provinces: 省份列表
+        years: 与 values 列对应的年份
+        steps: 预测步数
+    返回:
+        省份 -> (预测值, 是否拟合成功)；预处理失败的省份不在结果中，由级联自行拟合
+    """
+    names, rows, caps = [], [], []
+    for province, row in zip(provinces, values):
         try:
-            # 准备Prophet数据
-            prophet_df = pd.DataFrame({
-                'ds': series.index,
-                'y': series.values
-            })
-            
-            # 设置合理的容量上限
-            cap = series.max() * 3 * PROVINCE_POLICY.get(province, 1.0)
-            prophet_df['cap'] = cap
-            
-            # 训练Prophet模型
-            model = Prophet(
-                growth='logistic',
-                yearly_seasonality=True,
-                weekly_seasonality=False,
-                daily_seasonality=False,
-                changepoint_prior_scale=0.05,
-                seasonality_prior_scale=10.0
-            )
-            model.add_country_holidays(country_name='CN')
-            model.fit(prophet_df)
-            
-            # 生成预测
-            future = model.make_future_dataframe(periods=steps, freq='YS')
-            future['cap'] = cap * np.linspace(1, 1.5, len(future))
-            forecast = model.predict(future)['yhat'].values[-steps:]
-            
-        except Exception as prophet_error:
-            print(f"{province} Prophet失败: {str(prophet_error)}. 使用稳健增长...")
-            base_value = series.iloc[-1]
-            hist_growth = np.clip(series.pct_change().mean(), min_growth, max_growth)
-            forecast = base_value * (1 + hist_growth) ** np.arange(1, steps+1)
+            series = preprocess_series(row, years, province)
+        except Exception:
+            continue
+        if not np.isfinite(series.values).all():
+            continue
+        names.append(province)
+        rows.append(series.values)
+        caps.append(_saturating_cap(series, province))
+    if not names:
+        return {}
+    curves, ok = saturating_growth_forecast(np.vstack(rows), caps, steps)
+    return {province: (curve, bool(flag)) for province, curve, flag in zip(names, curves, ok)}
+
+def _prophet_forecast(series: pd.Series, province: str, steps: int) -> np.ndarray:
+    """Prophet 逻辑增长预测"""
+    # 准备Prophet数据
+    prophet_df = pd.DataFrame({
+        'ds': series.index,
+        'y': series.values
+    })
     
-    # 后处理
-    max_cap = PROVINCE_CAPACITY.get(province, 1000000)
-    forecast = np.clip(forecast, a_min=series.min()*0.9, a_max=max_cap)
+    # 设置合理的容量上限
+    cap = _saturating_cap(series, province)
+    prophet_df['cap'] = cap
+    
+    # 训练Prophet模型
+    model = get_backend('prophet')(
+        growth='logistic',
+        yearly_seasonality=True,
+        weekly_seasonality=False,
+        daily_seasonality=False,
+        changepoint_prior_scale=0.05,
+        seasonality_prior_scale=10.0
+    )
+    model.add_country_holidays(country_name='CN')
+    model.fit(prophet_df)
+    
+    # 生成预测
+    future = model.make_future_dataframe(periods=steps, freq='YS')
+    future['cap'] = cap * np.linspace(1, 1.5, len(future))
+    return model.predict(future)['yhat'].values[-steps:]
+
+def robust_growth_forecast(history: np.ndarray,
+                           min_growth: Any,
+                           max_growth: Any,
+                           steps: int = 8) -> np.ndarray:
+    """
+    批量稳健增长预测
+    参数:
+        history: (省份数, 年数) 历史数据矩阵
+        min_growth / max_growth: 增长率下限/上限（标量或每行一个值）
+        steps: 预测步数
+    返回:
+        (省份数, steps) 预测矩阵: 以最新值为基数，按截断后的历史平均增长率外推
+    """
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = history[:, 1:] / history[:, :-1] - 1
+    hist_growth = np.clip(np.nanmean(growth, axis=1), min_growth, max_growth)
+    return history[:, -1:] * (1 + hist_growth[:, None]) ** np.arange(1, steps+1)
+
+def postprocess_forecasts(forecasts: np.ndarray,
+                          floors: Any,
+                          caps: Any,
+                          min_growth: Any,
+                          sigma: float = 0.8) -> np.ndarray:
+    """
+    批量后处理: 截断、单调增长修正与平滑
+    参数:
+        forecasts: (省份数, 预测步数) 预测矩阵
+        floors / caps: 每行的下限/上限
+        min_growth: 每行的最小增长率，出现下降时按上一期值乘以 (1+min_growth) 修正
+        sigma: 高斯平滑参数
+    返回:
+        处理后的预测矩阵
+    说明:
+        单调修正沿预测步逐列扫描，每列对所有省份一次性计算，耗时与省份数量基本无关
+    """
+    values = np.array(forecasts, dtype=float, ndmin=2)
+    n_rows = values.shape[0]
+    floors = np.broadcast_to(np.asarray(floors, dtype=float), (n_rows,))
+    caps = np.broadcast_to(np.asarray(caps, dtype=float), (n_rows,))
+    min_growth = np.broadcast_to(np.asarray(min_growth, dtype=float), (n_rows,))
+    
+    values = np.clip(values, floors[:, None], caps[:, None])
     
     # 确保单调增长
-    for i in range(1, len(forecast)):
-        if forecast[i] < forecast[i-1]:
-            forecast[i] = forecast[i-1] * (1 + min_growth)
+    for i in range(1, values.shape[1]):
+        prev = values[:, i-1]
+        values[:, i] = np.where(values[:, i] < prev, prev * (1 + min_growth), values[:, i])
     
     # 平滑处理
-    return gaussian_filter1d(forecast, sigma=0.8)
-
-def main():
-    # 准备数据
-    data = {
-        "省份": ["北京", "天津", "河北", "山西", "内蒙古", "辽宁", "吉林", "黑龙江", 
-               "上海", "江苏", "浙江", "安徽", "福建", "江西", "山东", "河南", 
-               "湖北", "湖南", "广东", "广西", "海南", "重庆", "四川", "贵州", 
-               "云南", "西藏", "陕西", "甘肃", "青海", "宁夏", "新疆"],
-        "2016": [21940,6782,7307,3349,92,2520,47,82,16444,15869,5246,6756,2810,446,12340,2132,4266,2041,21108,393,365,2362,2986,282,412,9,1973,339,248,189,119],
-        "2017": [30363,9788,9875,5244,177,3184,259,579,26314,22075,9866,9909,5046,1357,17557,3702,6214,3655,29262,951,916,4949,4731,829,1429,9,3774,1226,340,199,124],
-        "2018": [41644,11209,11957,6500,1224,4280,733,1883,39303,30333,14226,10228,7942,2943,20798,8131,9722,5184,35928,1771,1403,8538,8169,1779,1987,17,8705,2327,445,233,207],
-        "2019": [59060,16687,22307,12027,2525,6044,1763,2666,55113,60509,29138,25754,17074,6744,32130,15968,17592,10498,62834,3596,3354,11245,14150,3207,3702,18,14857,3426,947,363,913],
-        "2020": [87634,27846,31804,19455,3490,8258,3768,4860,85538,77053,61542,38959,25926,11343,48890,32816,33408,18554,85874,7580,5813,17533,23872,4902,6004,193,25569,4377,1115,1510,1897],
-        "2021": [96840,33383,38491,25474,4500,10285,3811,7070,103249,97265,82041,58307,39853,15547,60251,43556,58627,27095,181846,14026,14042,20608,38312,9355,13600,391,34738,5637,1784,2190,3206],
-        "2022": [110145,46565,48950,33593,7696,12907,6810,9015,122235,129677,125918,84129,67299,26739,89965,68016,101163,41336,382960,33246,27596,38512,61416,20261,32146,557,48277,8088,2326,3329,4802]
-    }
+    return gaussian_filter1d(values, sigma=sigma, axis=1)
+
+def postprocess_bounds(series: pd.Series, province: str):
+    """单个省份的后处理参数: (下限, 上限, 最小增长率)"""
+    return series.min()*0.9, PROVINCE_CAPACITY.get(province, 1000000), _growth_bounds(province)[0]
+
+class TierTimeout(BaseException):
+    """
+    模型层超出时间预算
+    继承 BaseException，避免被 auto_arima(error_action='ignore') 等内部的 except Exception 吞掉
+    """
+
+@contextmanager
+def _time_limit(seconds: Optional[float]):
+    """
+    限时执行上下文
+    支持 SIGALRM 的平台（主线程中）超时即中断；其他平台（如Windows）在执行结束后判定是否超时
+    """
+    if seconds is None:
+        yield
+        return
+    if seconds <= 0:
+        raise TierTimeout("时间预算已用尽")
     
-    # 转换数据格式
-    df = pd.DataFrame(data).melt(
-        id_vars=["省份"],
-        var_name="年份",
-        value_name="公共充电桩保有量（台）"
+    use_signal = hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread()
+    start = time.time()
+    if use_signal:
+        def handler(signum, frame):
+            raise TierTimeout(f"超出时间预算 {seconds:.1f}s")
+        previous = signal.signal(signal.SIGALRM, handler)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        if use_signal:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    if time.time() - start > seconds:
+        raise TierTimeout(f"超出时间预算 {seconds:.1f}s")
+
+def _tier_budget(tier: str, deadline: Optional[float]) -> Optional[float]:
+    """模型层可用时间: 取该层预算与剩余时间（截止时刻为 time.time() 时间戳）的较小值"""
+    budgets = [b for b in (TIER_TIME_BUDGET.get(tier),
+                           None if deadline is None else deadline - time.time()) if b is not None]
+    return min(budgets) if budgets else None
+
+def forecast_with_record(series: pd.Series,
+                         province: str,
+                         steps: int = 8,
+                         cache_dir: Optional[str] = MODEL_CACHE_DIR,
+                         warm_state: Optional[Dict[str, Any]] = None,
+                         deadline: Optional[float] = None,
+                         saturating_fit: Optional[Tuple[np.ndarray, bool]] = None):
+    """
+    混合预测模型（未后处理）: ARIMA -> 饱和增长 -> Prophet（USE_PROPHET 时）-> 稳健增长
+    参数:
+        series: 年度时间序列
+        province: 省份名称
+        steps: 预测步数
+        cache_dir: 模型缓存目录，None 表示不使用缓存
+        warm_state: 上次运行的模型记录；序列新增观测且上次为ARIMA时，沿用其阶数并以其参数热启动
+        deadline: 截止时刻（time.time() 时间戳），与 TIER_TIME_BUDGET 共同限制各层耗时
+        saturating_fit: batch_saturating_fits 预先联合拟合的 (预测值, 是否成功)，提供时饱和增长层不再单独拟合
+    返回:
+        (预测值数组, 模型记录, 各层耗时)，模型记录包含所用层级、ARIMA阶数/参数及序列长度；
+        超时的层记为失败并进入下一层，稳健增长层始终可用；
+        只有数据导致的失败（DATA_REJECTION_ERRORS）才把降级后的层级写入缓存
+    """
+    min_growth, max_growth = _growth_bounds(province)
+    
+    key = _model_cache_key(series, province) if cache_dir else None
+    cached = load_cached_model(key, cache_dir) if cache_dir else None
+    tiers = ['arima', 'saturating', 'prophet', 'growth']
+    start = tiers.index(cached['tier']) if cached and cached.get('tier') in tiers else 0
+    record = None
+    forecast = None
+    timings = {}
+    skip_cache = False
+    
+    def run_tier(tier, func):
+        """在时间预算内执行一层模型，返回 (预测值, 记录)，失败或超时返回 (None, None)"""
+        nonlocal skip_cache
+        began = time.time()
+        try:
+            with _time_limit(_tier_budget(tier, deadline)):
+                return func()
+        except TierTimeout as e:
+            skip_cache = True
+            print(f"{province} {tier} 层超时: {str(e)}")
+        except DATA_REJECTION_ERRORS as e:
+            print(f"{province} {tier} 层失败: {str(e)}")
+        except Exception as e:
+            skip_cache = True
+            print(f"{province} {tier} 层不可用: {type(e).__name__}: {str(e)}")
+        finally:
+            timings[tier] = timings.get(tier, 0.0) + time.time() - began
+        return None, None
+    
+    warm = (
+        cached is None
+        and warm_state is not None
+        and warm_state.get('tier') == 'arima'
+        and len(series) > warm_state.get('n_obs', len(series))
     )
+    if warm:
+        # 增量更新失败时重新搜索ARIMA阶数
+        forecast, record = run_tier('arima', lambda: _arima_warm_forecast(series, warm_state, steps))
+    
+    if forecast is None and start == 0:
+        if cached:
+            forecast, record = run_tier('arima', lambda: (_arima_cached_forecast(series, cached, steps), cached))
+        else:
+            # 尝试ARIMA模型
+            forecast, record = run_tier('arima', lambda: _arima_search_forecast(series, steps))
+    
+    if forecast is None and start <= 1:
+        def saturating():
+            if saturating_fit is not None:
+                curve, ok = saturating_fit
+            else:
+                curves, flags = saturating_growth_forecast(series.values, _saturating_cap(series, province), steps)
+                curve, ok = curves[0], flags[0]
+            if not ok:
+                raise ValueError("饱和增长模型拟合误差过大")
+            return curve, {'tier': 'saturating', 'model': SATURATING_MODEL}
+        forecast, record = run_tier('saturating', saturating)
+    
+    if forecast is None and start <= 2 and USE_PROPHET:
+        forecast, record = run_tier('prophet', lambda: (_prophet_forecast(series, province, steps), {'tier': 'prophet'}))
+    
+    if forecast is None:
+        began = time.time()
+        forecast = robust_growth_forecast(series.values, min_growth, max_growth, steps)[0]
+        record = {'tier': 'growth'}
+        timings['growth'] = time.time() - began
+    
+    record = dict(record, n_obs=len(series))
+    # 超时或环境错误导致的降级不写入缓存，避免后续运行直接跳过被中断或暂不可用的层
+    if cache_dir and record != cached and not skip_cache:
+        save_cached_model(key, record, cache_dir)
+    
+    return np.asarray(forecast, dtype=float), record, timings
+
+def hybrid_forecast(series: pd.Series,
+                    province: str,
+                    steps: int = 8,
+                    cache_dir: Optional[str] = MODEL_CACHE_DIR,
+                    postprocess: bool = True,
+                    warm_state: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    """
+    混合预测模型: ARIMA -> 饱和增长 -> Prophet（USE_PROPHET 时）-> 稳健增长
+    参数:
+        series: 年度时间序列
+        province: 省份名称
+        steps: 预测步数
+        cache_dir: 模型缓存目录，None 表示不使用缓存
+        postprocess: 是否执行截断/单调/平滑后处理（批量流程中由 postprocess_forecasts 统一处理）
+        warm_state: 上次运行的模型记录，用于增量更新
+    返回:
+        预测值数组
+    说明:
+        缓存记录所选模型层级及ARIMA阶数/参数，序列与设置不变时跳过 auto_arima 搜索
+    """
+    forecast, _, _ = forecast_with_record(series, province, steps, cache_dir, warm_state)
+    if not postprocess:
+        return forecast
+    
+    # 后处理
+    floor, cap, min_growth = postprocess_bounds(series, province)
+    return postprocess_forecasts(forecast, floor, cap, min_growth)[0]
+
+def arima_error_structure(series: pd.Series, record: Dict[str, Any], steps: int = 8):
+    """
+    ARIMA层的误差结构，用于残差自助法模拟
+    返回:
+        (去中心化的样本内残差, 长度为 steps 的脉冲响应系数 psi)，误差的第 h 步为 sum_j psi[j]*eps[h-j]
+    """
+    arima_fit = get_backend('arima')(series, order=tuple(record['order'])).filter(np.asarray(record['params']))
+    resid = np.asarray(arima_fit.resid, dtype=float)[arima_fit.loglikelihood_burn:]
+    psi = np.asarray(arima_fit.impulse_responses(steps=steps-1), dtype=float).ravel()[:steps]
+    return resid - resid.mean(), psi
+
+def simulate_forecast_paths(forecasts: np.ndarray,
+                            histories: List[np.ndarray],
+                            residuals: List[Optional[np.ndarray]],
+                            psis: List[Optional[np.ndarray]],
+                            n_paths: int = 1000,
+                            seed: Optional[int] = RANDOM_SEED) -> np.ndarray:
+    """
+    批量模拟未来路径
+    参数:
+        forecasts: (省份数, 预测步数) 点预测矩阵（未后处理）
+        histories: 各省份的历史序列
+        residuals / psis: ARIMA层省份的残差与脉冲响应系数，其他层为 None
+        n_paths: 路径数
+        seed: 随机种子
+    返回:
+        (路径数, 省份数, 预测步数) 数组
+    说明:
+        ARIMA层: 有放回抽取残差，经 psi 系数累积为各步误差后叠加到点预测上；
+        其他层: 从最近 GROWTH_SAMPLE_WINDOW 年的对数增长率中有放回抽取其相对均值的偏离，
+        逐年累积后按比例缩放点预测
+    """
+    rng = np.random.default_rng(seed)
+    forecasts = np.asarray(forecasts, dtype=float)
+    n_rows, steps = forecasts.shape
+    paths = np.repeat(forecasts[None, :, :], n_paths, axis=0)
+    
+    # ARIMA层: 残差自助法
+    arima_rows = np.array([i for i in range(n_rows) if residuals[i] is not None and len(residuals[i]) > 0], dtype=int)
+    if arima_rows.size:
+        lengths = np.array([len(residuals[i]) for i in arima_rows])
+        pool = np.zeros((arima_rows.size, lengths.max()))
+        psi = np.zeros((arima_rows.size, steps))
+        for k, i in enumerate(arima_rows):
+            pool[k, :lengths[k]] = residuals[i]
+            psi[k] = psis[i][:steps]
+        draws = (rng.random((n_paths, arima_rows.size, steps)) * lengths[None, :, None]).astype(int)
+        eps = pool[np.arange(arima_rows.size)[None, :, None], draws]
+        # psi_matrix[p, h, j] = psi[p, h-j] (j <= h)
+        lag = np.arange(steps)[:, None] - np.arange(steps)[None, :]
+        psi_matrix = np.where(lag >= 0, psi[:, np.clip(lag, 0, None)], 0.0)
+        paths[:, arima_rows, :] += np.einsum('kpj,phj->kph', eps, psi_matrix)
+    
+    # 其他层: 增长率抽样
+    growth_rows = np.setdiff1d(np.arange(n_rows), arima_rows)
+    if growth_rows.size:
+        window = GROWTH_SAMPLE_WINDOW
+        pool = np.zeros((growth_rows.size, window))
+        lengths = np.ones(growth_rows.size, dtype=int)
+        for k, i in enumerate(growth_rows):
+            history = np.asarray(histories[i], dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_growth = np.log(history[1:] / history[:-1])
+            log_growth = log_growth[np.isfinite(log_growth)][-window:]
+            if len(log_growth):
+                pool[k, :len(log_growth)] = log_growth - log_growth.mean()
+                lengths[k] = len(log_growth)
+        draws = (rng.random((n_paths, growth_rows.size, steps)) * lengths[None, :, None]).astype(int)
+        sampled = pool[np.arange(growth_rows.size)[None, :, None], draws]
+        paths[:, growth_rows, :] *= np.exp(np.cumsum(sampled, axis=2))
     
-    # 准备空间权重
-    adjacency = {
-        "北京": ["天津", "河北"], "天津": ["北京", "河北"], 
-        "河北": ["北京", "天津", "山西", "内蒙古", "辽宁", "山东", "河南"],
-        "山西": ["河北", "内蒙古", "陕西", "河南"],
-        "内蒙古": ["河北", "山西", "陕西", "宁夏", "甘肃", "黑龙江", "吉林", "辽宁"],
-        "辽宁": ["河北", "内蒙古", "吉林"],
-        "吉林": ["辽宁", "内蒙古", "黑龙江"],
-        "黑龙江": ["吉林", "内蒙古"],
-        "上海": ["江苏", "浙江"],
-        "江苏": ["上海", "浙江", "安徽", "山东"],
-        "浙江": ["上海", "江苏", "安徽", "江西", "福建"],
-        "安徽": ["江苏", "浙江", "江西", "湖北", "河南", "山东"],
-        "福建": ["浙江", "江西", "广东"],
-        "江西": ["安徽", "浙江", "福建", "广东", "湖南", "湖北"],
-        "山东": ["河北", "河南", "安徽", "江苏"],
-        "河南": ["河北", "山西", "陕西", "湖北", "安徽", "山东"],
-        "湖北": ["河南", "陕西", "重庆", "湖南", "江西", "安徽"],
-        "湖南": ["湖北", "江西", "广东", "广西", "贵州", "重庆"],
-        "广东": ["福建", "江西", "湖南", "广西", "海南"],
-        "广西": ["湖南", "广东", "云南", "贵州"],
-        "海南": ["广东"],
-        "重庆": ["湖北", "湖南", "贵州", "四川", "陕西"],
-        "四川": ["重庆", "陕西", "甘肃", "青海", "西藏", "云南", "贵州"],
-        "贵州": ["重庆", "四川", "云南", "广西", "湖南"],
-        "云南": ["四川", "贵州", "广西", "西藏"],
-        "西藏": ["四川", "云南", "新疆", "青海"],
-        "陕西": ["山西", "内蒙古", "宁夏", "甘肃", "四川", "重庆", "湖北", "河南"],
-        "甘肃": ["内蒙古", "宁夏", "陕西", "四川", "青海", "新疆"],
-        "青海": ["甘肃", "四川", "西藏", "新疆"],
-        "宁夏": ["内蒙古", "陕西", "甘肃"],
-        "新疆": ["甘肃", "青海", "西藏"]
+    return paths
+
+def forecast_quantiles(results: Dict[str, Dict[str, Any]],
+                       provinces: List[str],
+                       weight_matrix: sparse.csr_matrix,
+                       latest_values: np.ndarray,
+                       n_paths: int = 1000,
+                       quantiles=PREDICTION_QUANTILES,
+                       seed: Optional[int] = RANDOM_SEED) -> np.ndarray:
+    """
+    对 run_forecasts 的结果做概率预测: 模拟路径后逐路径执行与点预测相同的后处理和空间调整
+    返回:
+        (分位数个数, 省份数, 预测步数) 数组；应急方案省份与点预测一致，不做后处理与空间调整
+    """
+    succeeded = np.array([results[p]['error'] is None for p in provinces])
+    forecasts = np.vstack([
+        results[p]['raw_forecast'] if results[p]['error'] is None else results[p]['forecast']
+        for p in provinces
+    ])
+    histories = [results[p].get('history', np.array([])) for p in provinces]
+    bounds = np.array([
+        results[p]['bounds'] if results[p]['error'] is None else (-np.inf, np.inf, 0.0)
+        for p in provinces
+    ], dtype=float)
+    paths = simulate_forecast_paths(
+        forecasts, histories,
+        [results[p].get('residuals') for p in provinces],
+        [results[p].get('psi') for p in provinces],
+        n_paths=n_paths, seed=seed
+    )
+    n_rows, steps = forecasts.shape
+    
+    # 后处理: 将路径展平为 (路径数*省份数, 预测步数) 一次处理
+    flat = paths.reshape(-1, steps)
+    processed = postprocess_forecasts(
+        flat,
+        floors=np.tile(bounds[:, 0], n_paths),
+        caps=np.tile(bounds[:, 1], n_paths),
+        min_growth=np.tile(bounds[:, 2], n_paths)
+    ).reshape(n_paths, n_rows, steps)
+    paths = np.where(succeeded[None, :, None], processed, paths)
+    
+    # 空间调整: 所有路径拼接为 (省份数, 路径数*预测步数)，一次稀疏乘法
+    stacked = paths.transpose(1, 0, 2).reshape(n_rows, -1)
+    adjusted = spatial_adjustment_matrix(stacked, weight_matrix, latest_values=latest_values)
+    adjusted = adjusted.reshape(n_rows, n_paths, steps).transpose(1, 0, 2)
+    paths = np.where(succeeded[None, :, None], adjusted, paths)
+    
+    return np.quantile(paths, quantiles, axis=0)
+
+def load_model_state(path: str = MODEL_STATE_PATH) -> Dict[str, Dict[str, Any]]:
+    """读取上次运行保存的各省份模型记录"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_model_state(state: Dict[str, Dict[str, Any]], path: str = MODEL_STATE_PATH) -> None:
+    """保存各省份模型记录，供下次增量更新使用"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"保存模型状态失败: {str(e)}")
+
+def fallback_forecast(history: np.ndarray, steps: int = 8) -> List[float]:
+    """应急方案: 以最近一个有数据年份的保有量（宽表中的一行）为基数，按行业平均增长率12%外推"""
+    history = np.asarray(history, dtype=float)
+    observed = history[~np.isnan(history)]
+    base_value = observed[-1] if len(observed) else np.nan
+    return [base_value * (1.12 ** i) for i in range(1, steps+1)]
+
+def _forecast_worker(province: str,
+                     values: np.ndarray,
+                     years: List[int],
+                     steps: int = 8,
+                     warm_state: Optional[Dict[str, Any]] = None,
+                     run_deadline: Optional[float] = None,
+                     with_uncertainty: bool = False,
+                     saturating_fit: Optional[Tuple[np.ndarray, bool]] = None) -> Dict[str, Any]:
+    """
+    单省份预测任务（可在子进程中运行）
+    参数:
+        province: 省份名称
+        values: 该省份在宽表中的一行
+        years: 与 values 对应的年份
+        steps: 预测步数
+        warm_state: 上次运行的模型记录（增量更新）
+        run_deadline: 整次运行的截止时刻（time.time() 时间戳）
+        with_uncertainty: 是否同时返回概率预测所需的ARIMA残差与脉冲响应系数
+        saturating_fit: 预先联合拟合的饱和增长层结果（见 batch_saturating_fits）
+    返回:
+        包含省份、预测值和错误信息的字典，异常在任务内部捕获，不向外抛出
+    """
+    print(f"\n正在处理: {province}")
+    deadline = None if PROVINCE_TIME_BUDGET is None else time.time() + PROVINCE_TIME_BUDGET
+    if run_deadline is not None:
+        deadline = run_deadline if deadline is None else min(deadline, run_deadline)
+    try:
+        # 预处理数据
+        series = preprocess_series(values, years, province)
+        
+        # 时间序列预测（后处理在汇总后批量执行）
+        forecast, record, timings = forecast_with_record(
+            series, province, steps=steps, warm_state=warm_state, deadline=deadline,
+            saturating_fit=saturating_fit
+        )
+        result = {
+            'province': province,
+            'forecast': forecast,
+            'history': series.values,
+            'bounds': postprocess_bounds(series, province),
+            'record': record,
+            'timings': timings,
+            'error': None
+        }
+        if with_uncertainty and record['tier'] == 'arima':
+            result['residuals'], result['psi'] = arima_error_structure(series, record, steps)
+        return result
+    
+    except Exception as e:
+        return {'province': province, 'forecast': None, 'error': str(e)}
+
+def run_forecasts(panel: pd.DataFrame,
+                  provinces: List[str],
+                  n_workers: int = FORECAST_WORKERS,
+                  steps: int = 8,
+                  model_state: Optional[Dict[str, Dict[str, Any]]] = None,
+                  with_uncertainty: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    执行各省份的预处理与混合预测
+    参数:
+        panel: build_panel 返回的 省份 × 年份 宽表
+        provinces: 省份列表
+        n_workers: 进程数，<=1 时串行执行
+        steps: 预测步数
+        model_state: 上次运行的各省份模型记录，提供时按增量更新方式热启动
+        with_uncertainty: 是否返回概率预测所需的误差结构（见 forecast_quantiles）
+    返回:
+        省份 -> 预测结果字典；单个省份失败（含子进程崩溃）只记录错误，不中断整体运行
+    说明:
+        饱和增长层在分发任务前对所有省份一次联合拟合（batch_saturating_fits）；
+        每个省份受 PROVINCE_TIME_BUDGET 限制，整次运行受 RUN_TIME_BUDGET 限制，
+        预算用尽后剩余省份直接使用稳健增长层，保证总耗时可预期
+    """
+    years = list(panel.columns)
+    values = panel.reindex(provinces).to_numpy(dtype=float)
+    model_state = model_state or {}
+    run_deadline = None if RUN_TIME_BUDGET is None else time.time() + RUN_TIME_BUDGET
+    # 饱和增长层对所有省份一次联合拟合，级联中直接取用
+    saturating_fits = batch_saturating_fits(values, provinces, years, steps)
+    tasks = {
+        province: (province, row, years, steps, model_state.get(province), run_deadline, with_uncertainty,
+                   saturating_fits.get(province))
+        for province, row in zip(provinces, values)
     }
+    results = {}
+    
+    if n_workers <= 1:
+        for province in provinces:
+            results[province] = _forecast_worker(*tasks[province])
+    else:
+        _run_in_pool(tasks, provinces, n_workers, results)
+    
+    # 对成功的省份整体执行后处理
+    succeeded = [province for province in provinces if results[province]['error'] is None]
+    if succeeded:
+        bounds = np.array([results[province]['bounds'] for province in succeeded], dtype=float)
+        processed = postprocess_forecasts(
+            np.vstack([results[province]['forecast'] for province in succeeded]),
+            floors=bounds[:, 0], caps=bounds[:, 1], min_growth=bounds[:, 2]
+        )
+        for province, row in zip(succeeded, processed):
+            results[province]['raw_forecast'] = results[province]['forecast']
+            results[province]['forecast'] = row
+    return results
+
+def _run_in_pool(tasks: Dict[str, tuple],
+                 provinces: List[str],
+                 n_workers: int,
+                 results: Dict[str, Dict[str, Any]]) -> None:
+    """
+    在进程池中执行各省份预测，结果写入 results
+    说明:
+        某个子进程异常退出（段错误、内存不足被杀、os._exit 等）时进程池整体失效，
+        所有未完成的任务都会收到 BrokenProcessPool；这些省份随后逐个在独立进程中重跑，
+        只有自身导致进程崩溃的省份记为失败，其余省份正常得到预测
+    """
+    unfinished = _pool_batch(tasks, provinces, n_workers, results)
+    for province in unfinished:
+        if _pool_batch(tasks, [province], 1, results):
+            results[province] = {'province': province, 'forecast': None, 'error': '预测子进程异常退出'}
+
+def _pool_batch(tasks: Dict[str, tuple],
+                provinces: List[str],
+                n_workers: int,
+                results: Dict[str, Dict[str, Any]]) -> List[str]:
+    """在一个进程池中执行一批省份，返回因进程池失效而未完成的省份（按原顺序）"""
+    broken = set()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(_forecast_worker, *tasks[province]): province
+            for province in provinces
+        }
+        for future in as_completed(futures):
+            province = futures[future]
+            try:
+                results[province] = future.result()
+            except BrokenProcessPool:
+                broken.add(province)
+            except Exception as e:
+                # 参数无法序列化等单个任务的异常
+                results[province] = {'province': province, 'forecast': None, 'error': str(e)}
+    return [province for province in provinces if province in broken]
+
+def main(n_workers: int = FORECAST_WORKERS,
+         incremental: bool = INCREMENTAL_UPDATE,
+         data_path: Optional[str] = None,
+         n_paths: int = PROBABILISTIC_PATHS,
+         mode: str = FORECAST_MODE,
+         reconcile_method: Optional[str] = RECONCILE_METHOD):
+    """
+    参数:
+        n_workers: 并行进程数
+        incremental: 是否按增量更新方式运行
+        data_path: 可选的 CSV/Parquet 长表路径（省份、年份、保有量），提供时分块读取替代内置数据
+        n_paths: 概率预测的模拟路径数，大于0时在点预测旁输出 PREDICTION_QUANTILES 对应的分位数列
+        mode: 'hybrid' 或 'global'（见 FORECAST_MODE）
+        reconcile_method: 层级协调方法（见 RECONCILE_METHOD），协调后的省份预测替代原预测，全部层级另存一份；
+            分位数列按各省份的协调调整量平移
+    """
+    if mode not in FORECAST_MODES:
+        raise ValueError(f"未知的预测方式: {mode}，应为 {' / '.join(FORECAST_MODES)}")
+    
+    # 准备数据: 省份 × 年份 宽表，后续按行索引取数
+    panel = load_panel(data_path) if data_path else builtin_panel()
     
     # 确保省份顺序一致
-    provinces = sorted(df['省份'].unique())
-    w = prepare_spatial_weights(provinces, adjacency)
+    provinces = list(panel.index)
+    w = prepare_spatial_weights(provinces, PROVINCE_ADJACENCY)
+    weight_matrix = spatial_weight_matrix(w, provinces)
+    # 未启用空间调整时用全零矩阵，各省份保持原预测（全局面板模型仍使用真实邻接作为特征）
+    adjustment_matrix = weight_matrix if SPATIAL_ADJUSTMENT else sparse.csr_matrix(weight_matrix.shape)
     
     # 准备各省份最新数据用于空间调整
-    latest_data = df[df['年份'] == '2022'].set_index('省份')['公共充电桩保有量（台）'].to_dict()
+    latest_year = int(panel.columns[-1])
+    latest_data = panel[latest_year].to_dict()
     
     # 创建输出目录
     current_dir = os.path.dirname(os.path.abspath(__file__))
     output_folder = os.path.join(current_dir, "预测结果")
     os.makedirs(output_folder, exist_ok=True)
     
-    # 执行预测
-    all_predictions = []
-    for province in provinces:
-        print(f"\n正在处理: {province}")
-        province_data = df[df['省份'] == province]
-        
-        try:
-            # 预处理数据
-            series = preprocess_data(province_data, province)
-            
-            # 时间序列预测
-            ts_forecast = hybrid_forecast(series, province)
-            
-            # 空间调整
-            adjusted_forecast = [
-                spatial_adjustment(
-                    province=province,
-                    value=value,
-                    w=w,
-                    province_data=latest_data
-                )
-                for value in ts_forecast
-            ]
-            
-            all_predictions.append([province] + adjusted_forecast)
-            
-        except Exception as e:
-            print(f"{province} 预测失败: {str(e)}")
-            # 应急方案: 使用行业平均增长率12%
-            base_value = province_data[province_data['年份'] == '2022']['公共充电桩保有量（台）'].values[0]
-            forecast = [base_value * (1.12 ** i) for i in range(1, 9)]
-            all_predictions.append([province] + forecast)
+    # 增量更新: 读取上次运行的模型记录，新增观测的省份沿用原阶数热启动
+    model_state = load_model_state() if incremental else {}
+    if model_state:
+        n_obs = panel.shape[1]
+        updated = [p for p in provinces if model_state.get(p, {}).get('n_obs', n_obs) < n_obs]
+        print(f"增量更新: {len(updated)} 个省份存在新增年份数据")
+    
+    # 执行预测（按固定省份顺序合并结果，保证输出可复现）
+    if mode == 'global':
+        from Global_panel_model import run_global_forecasts
+        results = run_global_forecasts(panel, provinces, weight_matrix)
+    else:
+        results = run_forecasts(panel, provinces, n_workers=n_workers, model_state=model_state,
+                                with_uncertainty=n_paths > 0)
+        # 只保存逐省份混合模型的记录；全局模式不覆盖，下次 hybrid 运行仍可增量热启动
+        save_model_state({
+            province: result['record']
+            for province, result in results.items() if result['error'] is None
+        })
+    failed = [province for province in provinces if results[province]['error'] is not None]
+    for province in failed:
+        print(f"{province} 预测失败: {results[province]['error']}")
+        # 应急方案: 使用行业平均增长率12%
+        results[province]['forecast'] = np.asarray(fallback_forecast(panel.loc[province].values))
+    
+    # 空间调整（应急方案的结果不参与调整，但可作为邻域数据）
+    forecast_matrix = np.vstack([results[province]['forecast'] for province in provinces])
+    latest_values = np.array([latest_data.get(province, np.nan) for province in provinces], dtype=float)
+    adjusted = spatial_adjustment_matrix(forecast_matrix, adjustment_matrix, latest_values=latest_values)
+    is_failed = np.isin(provinces, failed)[:, None]
+    forecast_matrix = np.where(is_failed, forecast_matrix, adjusted)
+    forecast_years = list(range(latest_year + 1, latest_year + forecast_matrix.shape[1] + 1))
+    
+    # 层级协调: 全国与各省份预测加总一致；记录各省份的协调调整量，分位数带随点预测一起平移
+    reconcile_shift = np.zeros_like(forecast_matrix)
+    if reconcile_method:
+        from Hierarchical_reconciliation import reconcile_national_provincial
+        nodes, coherent = reconcile_national_provincial(
+            provinces, forecast_matrix, panel.reindex(provinces).to_numpy(dtype=float),
+            forecast_years, list(panel.columns), method=reconcile_method
+        )
+        reconcile_shift = coherent[len(nodes) - len(provinces):] - forecast_matrix
+        forecast_matrix = forecast_matrix + reconcile_shift
+        hierarchy_df = pd.DataFrame(coherent, columns=[f"{y}" for y in forecast_years])
+        hierarchy_df.insert(0, "地区", nodes)
+        hierarchy_paths = write_results(hierarchy_df, os.path.join(output_folder, "层级协调预测结果"), RESULT_FORMATS)
+        print(f"层级协调({reconcile_method})结果已保存至: {', '.join(hierarchy_paths)}")
+    
+    all_predictions = [
+        [province] + row.tolist()
+        for province, row in zip(provinces, forecast_matrix)
+    ]
     
     # 保存结果
     if all_predictions:
         predictions_df = pd.DataFrame(
             all_predictions,
-            columns=["省份"] + [f"{y}" for y in range(2023, 2031)]
+            columns=["省份"] + [f"{y}" for y in forecast_years]
         )
-        output_path = os.path.join(output_folder, "最终预测结果.xlsx")
-        predictions_df.to_excel(output_path, index=False)
-        print(f"\n预测结果已保存至: {output_path}")
+        
+        # 概率预测: 分位数列追加在点预测之后（模拟路径未经协调，按协调调整量平移，保证点预测仍在区间内）
+        if n_paths > 0:
+            bands = forecast_quantiles(results, provinces, adjustment_matrix, latest_values, n_paths=n_paths)
+            bands = bands + reconcile_shift[None]
+            for q, band in zip(PREDICTION_QUANTILES, bands):
+                for j, year in enumerate(forecast_years):
+                    predictions_df[f"{year}_P{round(q * 100)}"] = band[:, j]
+        output_paths = write_results(predictions_df, os.path.join(output_folder, "最终预测结果"), RESULT_FORMATS)
+        print(f"\n预测结果已保存至: {', '.join(output_paths)}")
+    
+    # 保存各省份所用模型层级及各层耗时
+    run_log = pd.DataFrame([
+        {
+            '省份': province,
+            '模型层级': results[province]['record']['tier'] if province not in failed else '应急增长',
+            **{f'{tier}耗时(秒)': round(seconds, 3)
+               for tier, seconds in results[province].get('timings', {}).items()}
+        }
+        for province in provinces
+    ])
+    log_path = os.path.join(output_folder, "模型运行记录.csv")
+    run_log.to_csv(log_path, index=False, encoding='utf-8-sig')
+    print(f"模型运行记录已保存至: {log_path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
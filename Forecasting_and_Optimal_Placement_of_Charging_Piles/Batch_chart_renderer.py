@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+无界面批量绘图
+
+使用 Agg 后端，在进程池中批量输出 PNG / SVG 图表:
+    - 全国指标（Sales / Patents / Chargers）的 Prophet / VAR / RF 预测对比图
+    - 各省份公共充电桩保有量的历史与预测（可带 P10-P90 预测区间）
+每个进程只创建一次图表模板（画布、坐标轴、刻度、图例），之后每张图只更新曲线数据后保存。
+"""
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from Chart_utils import CHART_DPI, headless_pyplot
+
+# 输出格式（分辨率见 Chart_utils.CHART_DPI）
+CHART_FORMATS = ('png',)
+
+# 预测曲线样式: 标签 -> (线型, 标记, 颜色)
+NATIONAL_STYLES = {
+    'Prophet预测': ('--', 's', 'blue'),
+    'VAR预测': ('--', '^', 'green'),
+    '随机森林预测': ('--', 'D', 'red'),
+}
+PROVINCE_STYLES = {
+    '混合模型预测': ('--', 's', '#d7191c'),
+}
+
+class ForecastChartTemplate:
+    """
+    可复用的预测图模板
+    坐标轴、刻度、网格与图例只在创建时设置一次；render 只替换曲线数据、区间和标题
+    """
+    def __init__(self,
+                 history_years: Sequence[int],
+                 forecast_years: Sequence[int],
+                 styles: Dict[str, Tuple[str, str, str]],
+                 figsize: Tuple[float, float] = (10, 5)):
+        plt = headless_pyplot()
+        self.history_years = np.asarray(history_years)
+        # 预测曲线从最后一个历史点连出
+        self.forecast_years = np.concatenate([self.history_years[-1:], np.asarray(forecast_years)])
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        self.history_line, = self.ax.plot([], [], label='历史数据', marker='o', color='black', linewidth=2)
+        self.forecast_lines = {
+            label: self.ax.plot([], [], linestyle=ls, marker=mk, color=color, alpha=0.7, label=label)[0]
+            for label, (ls, mk, color) in styles.items()
+        }
+        self.band = None
+        all_years = np.concatenate([self.history_years, self.forecast_years[1:]])
+        self.ax.set_xticks(all_years)
+        self.ax.set_xticklabels([str(y) for y in all_years], rotation=45)
+        self.ax.set_xlabel('年份')
+        self.ax.grid(True, linestyle='--', alpha=0.6)
+        self.ax.legend(loc='upper left')
+        self.fig.tight_layout()
+
+    def render(self,
+               title: str,
+               ylabel: str,
+               history: np.ndarray,
+               forecasts: Dict[str, np.ndarray],
+               out_base: str,
+               band: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+               formats: Sequence[str] = CHART_FORMATS,
+               dpi: int = CHART_DPI) -> List[str]:
+        """更新数据并写出图表，返回写出的文件路径"""
+        history = np.asarray(history, dtype=float)
+        self.history_line.set_data(self.history_years, history)
+        for label, line in self.forecast_lines.items():
+            values = forecasts.get(label)
+            if values is None:
+                line.set_data([], [])
+            else:
+                line.set_data(self.forecast_years, np.concatenate([history[-1:], np.asarray(values, dtype=float)]))
+
+        if self.band is not None:
+            self.band.remove()
+            self.band = None
+        if band is not None:
+            low, high = (np.asarray(b, dtype=float) for b in band)
+            self.band = self.ax.fill_between(self.forecast_years[1:], low, high, color='gray', alpha=0.2)
+
+        self.ax.set_title(title, fontsize=14)
+        self.ax.set_ylabel(ylabel)
+        # relim 只统计曲线，不包含 fill_between 的区间，需把区间上下界并入数据范围
+        self.ax.relim()
+        if band is not None:
+            self.ax.update_datalim(np.column_stack([
+                np.concatenate([self.forecast_years[1:], self.forecast_years[1:]]),
+                np.concatenate([low, high]),
+            ]))
+        self.ax.autoscale_view()
+
+        paths = []
+        for fmt in formats:
+            path = f"{out_base}.{fmt}"
+            self.fig.savefig(path, dpi=dpi, bbox_inches='tight')
+            paths.append(path)
+        return paths
+
+# ==================== 作业构建 ====================
+def national_chart_jobs(history_df: pd.DataFrame, result_df: pd.DataFrame, output_dir: str) -> List[Dict[str, Any]]:
+    """全国指标预测对比图（history_df 与 result_df 为 Predict_and_test 中的 df 与 get_forecasts()）"""
+    future = result_df[result_df.index > history_df.index[-1]]
+    model_labels = {'Prophet': 'Prophet预测', 'VAR': 'VAR预测', 'RF': '随机森林预测'}
+    return [
+        {
+            'kind': 'national',
+            'first_year': int(history_df.index[0].year),
+            'title': f'{col}预测（{history_df.index[0].year}-{future.index[-1].year}）',
+            'ylabel': col,
+            'history': history_df[col].values,
+            'forecasts': {label: future[f'{col}_{model}'].values for model, label in model_labels.items()},
+            'out_base': os.path.join(output_dir, f'全国_{col}'),
+        }
+        for col in history_df.columns
+    ]
+
+def province_chart_jobs(panel: pd.DataFrame, predictions: pd.DataFrame, output_dir: str) -> List[Dict[str, Any]]:
+    """
+    省份预测图
+    参数:
+        panel: 省份 × 年份 历史宽表
+        predictions: 最终预测结果表（'省份' 列 + 各年份列，可带 '<年份>_P10' / '<年份>_P90' 区间列）
+    """
+    predictions = predictions.set_index('省份')
+    year_cols = [c for c in predictions.columns if str(c).isdigit()]
+    has_band = all(f'{y}_P10' in predictions.columns and f'{y}_P90' in predictions.columns for y in year_cols)
+    jobs = []
+    for province, row in predictions.iterrows():
+        if province not in panel.index:
+            continue
+        jobs.append({
+            'kind': 'province',
+            'first_year': int(panel.columns[0]),
+            'title': f'{province}公共充电桩保有量预测',
+            'ylabel': '公共充电桩保有量（台）',
+            'history': panel.loc[province].values,
+            'forecasts': {'混合模型预测': row[year_cols].values},
+            'band': (row[[f'{y}_P10' for y in year_cols]].values,
+                     row[[f'{y}_P90' for y in year_cols]].values) if has_band else None,
+            'out_base': os.path.join(output_dir, f'省份_{province}'),
+        })
+    return jobs
+
+# ==================== 批量渲染 ====================
+# 每个进程内按 (图表类型, 历史年份, 预测年份) 缓存模板
+_TEMPLATES: Dict[tuple, ForecastChartTemplate] = {}
+
+def _template_for(job: Dict[str, Any]) -> ForecastChartTemplate:
+    n_hist = len(job['history'])
+    n_fc = len(next(iter(job['forecasts'].values())))
+    first_year = job['first_year']
+    key = (job['kind'], first_year, n_hist, n_fc)
+    if key not in _TEMPLATES:
+        history_years = np.arange(first_year, first_year + n_hist)
+        forecast_years = np.arange(first_year + n_hist, first_year + n_hist + n_fc)
+        styles = NATIONAL_STYLES if job['kind'] == 'national' else PROVINCE_STYLES
+        _TEMPLATES[key] = ForecastChartTemplate(history_years, forecast_years, styles)
+    return _TEMPLATES[key]
+
+def _render_batch(jobs: List[Dict[str, Any]], formats: Sequence[str], dpi: int) -> List[str]:
+    paths = []
+    for job in jobs:
+        try:
+            paths += _template_for(job).render(
+                job['title'], job['ylabel'], job['history'], job['forecasts'],
+                job['out_base'], band=job.get('band'), formats=formats, dpi=dpi
+            )
+        except Exception as e:
+            print(f"绘制 {job['title']} 失败: {str(e)}")
+    return paths
+
+def render_charts(jobs: List[Dict[str, Any]],
+                  formats: Sequence[str] = CHART_FORMATS,
+                  dpi: int = CHART_DPI,
+                  n_workers: Optional[int] = None) -> List[str]:
+    """
+    批量渲染图表
+    参数:
+        jobs: national_chart_jobs / province_chart_jobs 生成的作业，out_base 为不含扩展名的输出路径
+        formats: 输出格式，如 ('png', 'svg')
+        n_workers: 进程数，默认 CPU 核数；作业按进程均分成批，每个进程只建一次模板
+    返回:
+        写出的文件路径列表
+    """
+    if not jobs:
+        return []
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, len(jobs)))
+    for job in jobs:
+        os.makedirs(os.path.dirname(job['out_base']) or '.', exist_ok=True)
+    if n_workers == 1:
+        return _render_batch(jobs, formats, dpi)
+
+    batches = [jobs[i::n_workers] for i in range(n_workers)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(_render_batch, batches, [formats] * n_workers, [dpi] * n_workers)
+        return [path for batch in results for path in batch]
+
+if __name__ == "__main__":
+    import Predict_and_test as national
+    import ARIMA_randon_forest_predict as provincial
+    from Forecast_result_storage import read_results
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    output_dir = os.path.join(current_dir, "图表输出")
+
+    jobs = national_chart_jobs(national.df, national.get_forecasts(), output_dir)
+    try:
+        predictions = read_results(os.path.join(current_dir, "预测结果", "最终预测结果"))
+        jobs += province_chart_jobs(provincial.builtin_panel(), predictions, output_dir)
+    except FileNotFoundError as e:
+        print(f"跳过省份图表: {str(e)}")
+
+    paths = render_charts(jobs, formats=('png', 'svg'))
+    print(f"共输出 {len(paths)} 个图表文件至: {output_dir}")
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+绘图公共工具
+
+各绘图脚本（Predict_and_test、Batch_chart_renderer 等）共用的后端切换与图表保存，
+matplotlib 在函数内按需导入，导入本模块不加载 pyplot。
+"""
+from typing import Optional
+
+# 保存图表的默认分辨率
+CHART_DPI = 150
+
+def headless_pyplot():
+    """切换到 Agg 后端并返回 pyplot（必须在首次导入 pyplot 之前调用才对当前进程生效）"""
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
+
+def finish_figure(fig, save_path: Optional[str] = None, dpi: int = CHART_DPI) -> None:
+    """保存图表（给出路径时）；交互式后端下弹出窗口，Agg 后端下直接关闭"""
+    import matplotlib
+    import matplotlib.pyplot as plt
+    if save_path:
+        fig.savefig(save_path, dpi=dpi, bbox_inches='tight')
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.show()
+    plt.close(fig)
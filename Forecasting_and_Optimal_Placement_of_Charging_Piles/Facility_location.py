@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+需求加权的设施选址
+
+以预测需求（各省份或各需求点 2023-2030 年的预测保有量）为权重，在候选站点中选出 p 个站点:
+    - p_median: 最小化需求加权的到最近站点距离
+    - coverage: 最大覆盖，最大化服务半径内的需求量
+距离为球面（haversine）距离，单位公里。候选 × 需求 距离由 Spatial_index 的 BallTree 批量查询，以稀疏矩阵保存:
+p_median 每个需求点只保留最近的 NEAREST_CANDIDATES 个候选，coverage 保留服务半径内的全部候选，
+内存与 候选数 × 需求点数 无关，1 万候选 × 10 万需求点也可求解。
+启发式求解为贪心加点 + 交换改进（Teitz-Bart 式，每轮对所有 (加入, 移出) 组合一次向量化求增益）；
+小规模问题可用 scipy.optimize.milp 精确求解。
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from Spatial_index import PlanEvaluator, SiteIndex, haversine_km
+
+# 每个需求点保留的最近候选数、最大覆盖的服务半径（公里）
+NEAREST_CANDIDATES = 20
+COVERAGE_RADIUS_KM = 500.0
+# 交换改进的最大轮数
+MAX_SWAPS = 200
+# 批量贪心的轮数: 启用时（greedy_steps 参数）每轮加入增益最大的 ceil(待加数 / GREEDY_STEPS) 个，
+# 默认逐个加点；多期选址中每年待加站点较多，由 multi_period_plan 启用
+GREEDY_STEPS = 20
+
+def haversine_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a (n, 2)、b (m, 2) 为 [经度, 纬度]（度），返回 (n, m) 球面距离（公里）"""
+    return haversine_km(np.asarray(a, dtype=float)[:, None, :], np.asarray(b, dtype=float)[None, :, :])
+
+def candidate_distances(candidates: np.ndarray,
+                        demand: np.ndarray,
+                        k: int = NEAREST_CANDIDATES,
+                        radius: Optional[float] = None,
+                        index: Optional[SiteIndex] = None) -> sparse.coo_matrix:
+    """
+    稀疏 候选 × 需求 距离矩阵（由候选站点的 BallTree 索引批量查询）
+    参数:
+        k: 每个需求点保留最近的 k 个候选（radius 为 None 时）
+        radius: 给出时改为保留服务半径内的全部候选
+        index: 已建好的候选索引，默认按 candidates 新建
+    返回:
+        coo_matrix (候选数, 需求点数)，row/col/data 为候选下标、需求点下标与距离（距离为 0 的元素同样保留）
+    """
+    index = index or SiteIndex(candidates)
+    return index.knn_matrix(demand, k) if radius is None else index.within(demand, radius)
+
+def _unreachable_cost(distances: sparse.coo_matrix, unreachable_cost: Optional[float]) -> float:
+    """需求点的候选都未选中时的距离（默认为最大保留距离的 2 倍）"""
+    if unreachable_cost is not None:
+        return float(unreachable_cost)
+    return 2.0 * float(distances.data.max()) if distances.nnz else 1.0
+
+def _sort_by_demand(distances: sparse.coo_matrix) -> sparse.coo_matrix:
+    """将元素按 (需求点, 距离) 排序，之后任意子集仍保持该顺序（knn_matrix 的结果已有序，直接返回）"""
+    col, data = distances.col, distances.data
+    step = np.diff(col)
+    if np.all((step > 0) | ((step == 0) & (np.diff(data) >= 0))):
+        return distances
+    order = np.lexsort((data, col))
+    return sparse.coo_matrix((distances.data[order], (distances.row[order], distances.col[order])),
+                             shape=distances.shape)
+
+def _nearest_two(distances: sparse.coo_matrix, is_open: np.ndarray, penalty: float):
+    """
+    各需求点到已选站点的最近、次近距离及最近站点下标（无可达站点时为 penalty / -1）
+    distances 的元素需已按 _sort_by_demand 排序
+    """
+    n_demand = distances.shape[1]
+    c1 = np.full(n_demand, penalty)
+    c2 = np.full(n_demand, penalty)
+    phi1 = np.full(n_demand, -1)
+    sel = is_open[distances.row]
+    rows, cols, dist = distances.row[sel], distances.col[sel], distances.data[sel]
+    if len(dist):
+        first = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]])
+        c1[cols[first]] = np.minimum(dist[first], penalty)
+        phi1[cols[first]] = rows[first]
+        second = first + 1
+        has_second = second < len(cols)
+        has_second[has_second] = cols[second[has_second]] == cols[first[has_second]]
+        c2[cols[first[has_second]]] = np.minimum(dist[second[has_second]], penalty)
+    return c1, c2, phi1
+
+def _best_swap(gain: np.ndarray,
+               loss: np.ndarray,
+               pair_j: np.ndarray,
+               pair_r: np.ndarray,
+               correction: np.ndarray,
+               can_add: np.ndarray,
+               can_remove: np.ndarray) -> Tuple[int, int, float]:
+    """
+    最优交换 (加入 j, 移出第 r 个已选站点)，delta(j, r) = gain[j] + loss[r] + correction(j, r)，取最小值
+    correction 只在稀疏的 (pair_j, pair_r) 上非零且不大于 0，其余组合的最小值为 min(gain) + min(loss)，
+    因此无需构造 候选数 × 已选站点数 的稠密矩阵
+    """
+    gain = np.where(can_add, gain, np.inf)
+    loss = np.where(can_remove, loss, np.inf)
+    if not np.isfinite(gain).any() or not np.isfinite(loss).any():
+        return -1, -1, np.inf
+    best_j, best_r = int(np.argmin(gain)), int(np.argmin(loss))
+    best = gain[best_j] + loss[best_r]
+    if len(correction):
+        delta = gain[pair_j] + loss[pair_r] + correction
+        k = int(np.argmin(delta))
+        if delta[k] < best:
+            best_j, best_r, best = int(pair_j[k]), int(pair_r[k]), delta[k]
+    return best_j, best_r, float(best)
+
+def _pair_sum(pair_j: np.ndarray, pair_r: np.ndarray, values: np.ndarray, n_cand: int, n_open: int):
+    """按 (j, r) 组合求和（稀疏矩阵转换时合并重复元素），返回去重后的 (j, r, 和)"""
+    summed = sparse.coo_matrix((values, (pair_j, pair_r)), shape=(n_cand, n_open)).tocsr()
+    summed.sum_duplicates()
+    return np.repeat(np.arange(n_cand), np.diff(summed.indptr)), summed.indices, summed.data
+
+def _greedy_batch(remaining: int, greedy_steps: Optional[int]) -> int:
+    """贪心每轮加入的站点数: 默认 1 个，批量时为 ceil(待加数 / 轮数)"""
+    if greedy_steps is None:
+        return 1
+    return max(1, -(-remaining // greedy_steps))
+
+def p_median_heuristic(distances: sparse.coo_matrix,
+                       weights: np.ndarray,
+                       p: int,
+                       unreachable_cost: Optional[float] = None,
+                       initial: Optional[Sequence[int]] = None,
+                       max_swaps: int = MAX_SWAPS,
+                       fixed: Optional[Sequence[int]] = None,
+                       greedy_steps: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """
+    p-median 启发式: 贪心加点后做最优交换改进
+    参数:
+        distances: candidate_distances 返回的稀疏距离矩阵
+        weights: 各需求点的需求量
+        p: 选址数量
+        unreachable_cost: 无可达站点时的距离
+        initial: 初始站点（如上一期的解），不足 p 个时由贪心补足，再做交换改进
+        fixed: 必须保留的站点（如已建成的站点），会一并加入初始站点且不参与交换
+        greedy_steps: None 时贪心逐个加点；给出时分至多该轮数批量加点（见 GREEDY_STEPS）
+    返回:
+        (选中的候选下标, 需求加权总距离)
+    """
+    weights = np.asarray(weights, dtype=float)
+    n_cand = distances.shape[0]
+    penalty = _unreachable_cost(distances, unreachable_cost)
+    distances = _sort_by_demand(distances)
+    rows, cols, dist = distances.row, distances.col, distances.data
+    is_open = np.zeros(n_cand, dtype=bool)
+    is_fixed = np.zeros(n_cand, dtype=bool)
+    if initial is not None:
+        is_open[np.asarray(initial, dtype=int)] = True
+    if fixed is not None:
+        is_fixed[np.asarray(fixed, dtype=int)] = True
+        is_open |= is_fixed
+    c1, c2, phi1 = _nearest_two(distances, is_open, penalty)
+
+    # 贪心: 每轮加入使总距离下降最多的候选
+    target = min(p, n_cand)
+    batch = _greedy_batch(target - int(is_open.sum()), greedy_steps)
+    while is_open.sum() < target:
+        gain = np.bincount(rows, weights=weights[cols] * np.minimum(dist - c1[cols], 0.0), minlength=n_cand)
+        gain[is_open] = np.inf
+        n_add = min(batch, target - int(is_open.sum()))
+        is_open[np.argpartition(gain, n_add - 1)[:n_add]] = True
+        c1, c2, phi1 = _nearest_two(distances, is_open, penalty)
+
+    # 交换: delta(j, r) = 加入 j 的收益 + 移出 r 的损失 + 两者同时发生的修正项
+    for _ in range(max_swaps):
+        open_sites = np.flatnonzero(is_open)
+        if len(open_sites) == 0 or len(open_sites) == n_cand:
+            break
+        position = np.full(n_cand, -1)
+        position[open_sites] = np.arange(len(open_sites))
+        gain = np.bincount(rows, weights=weights[cols] * np.minimum(dist - c1[cols], 0.0), minlength=n_cand)
+        served = phi1 >= 0
+        loss = np.bincount(position[phi1[served]], weights=(weights * (c2 - c1))[served],
+                           minlength=len(open_sites))
+        hit = (phi1[cols] >= 0) & (dist < c2[cols])
+        pair_j, pair_r, correction = _pair_sum(
+            rows[hit], position[phi1[cols[hit]]],
+            -weights[cols[hit]] * (c2[cols[hit]] - np.maximum(dist[hit], c1[cols[hit]])), n_cand, len(open_sites)
+        )
+        j, r, delta = _best_swap(gain, loss, pair_j, pair_r, correction, ~is_open, ~is_fixed[open_sites])
+        if delta >= -1e-9 * max(1.0, float(weights @ c1)):
+            break
+        is_open[j], is_open[open_sites[r]] = True, False
+        c1, c2, phi1 = _nearest_two(distances, is_open, penalty)
+
+    return np.flatnonzero(is_open), float(weights @ c1)
+
+def coverage_heuristic(distances: sparse.coo_matrix,
+                       weights: np.ndarray,
+                       p: int,
+                       radius: float = COVERAGE_RADIUS_KM,
+                       initial: Optional[Sequence[int]] = None,
+                       max_swaps: int = MAX_SWAPS,
+                       greedy_steps: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """
+    最大覆盖启发式: 贪心加点后做最优交换改进（initial、greedy_steps 同 p_median_heuristic）
+    返回:
+        (选中的候选下标, 半径内被覆盖的需求量)
+    """
+    weights = np.asarray(weights, dtype=float)
+    n_cand = distances.shape[0]
+    within = distances.data <= radius
+    rows, cols = distances.row[within], distances.col[within]
+    is_open = np.zeros(n_cand, dtype=bool)
+    if initial is not None:
+        is_open[np.asarray(initial, dtype=int)] = True
+
+    def cover_state():
+        sel = is_open[rows]
+        count = np.bincount(cols[sel], minlength=len(weights))
+        # 只被一个站点覆盖的需求点，记录该站点（下标之和即为唯一站点）
+        sole = np.bincount(cols[sel], weights=rows[sel], minlength=len(weights)).astype(int)
+        return count, np.where(count == 1, sole, -1)
+
+    count, sole = cover_state()
+    target = min(p, n_cand)
+    batch = _greedy_batch(target - int(is_open.sum()), greedy_steps)
+    while is_open.sum() < target:
+        gain = np.bincount(rows, weights=weights[cols] * (count[cols] == 0), minlength=n_cand)
+        gain[is_open] = -np.inf
+        n_add = min(batch, target - int(is_open.sum()))
+        is_open[np.argpartition(-gain, n_add - 1)[:n_add]] = True
+        count, sole = cover_state()
+
+    for _ in range(max_swaps):
+        open_sites = np.flatnonzero(is_open)
+        if len(open_sites) == 0 or len(open_sites) == n_cand:
+            break
+        position = np.full(n_cand, -1)
+        position[open_sites] = np.arange(len(open_sites))
+        gain = np.bincount(rows, weights=weights[cols] * (count[cols] == 0), minlength=n_cand)
+        only = sole >= 0
+        loss = np.bincount(position[sole[only]], weights=weights[only], minlength=len(open_sites))
+        hit = sole[cols] >= 0
+        pair_j, pair_r, correction = _pair_sum(rows[hit], position[sole[cols[hit]]], weights[cols[hit]],
+                                               n_cand, len(open_sites))
+        # 以最小化形式求最优交换: -delta = -gain + loss - correction
+        j, r, delta = _best_swap(-gain, loss, pair_j, pair_r, -correction,
+                                 ~is_open, np.ones(len(open_sites), dtype=bool))
+        if -delta <= 1e-9 * max(1.0, float(weights.sum())):
+            break
+        is_open[j], is_open[open_sites[r]] = True, False
+        count, sole = cover_state()
+
+    return np.flatnonzero(is_open), float(weights[count > 0].sum())
+
+def solve_milp(distances: sparse.coo_matrix,
+               weights: np.ndarray,
+               p: int,
+               objective: str = 'p_median',
+               radius: float = COVERAGE_RADIUS_KM,
+               unreachable_cost: Optional[float] = None,
+               time_limit: Optional[float] = None) -> Tuple[np.ndarray, float]:
+    """
+    scipy.optimize.milp 精确求解（适合小规模问题），约束矩阵均为稀疏矩阵
+    p_median 变量: 站点 y、需求分配 x（稀疏距离矩阵的每个元素一个）、未服务 u
+    coverage 变量: 站点 y、覆盖 z
+    """
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    weights = np.asarray(weights, dtype=float)
+    n_cand, n_demand = distances.shape
+    options = {} if time_limit is None else {'time_limit': time_limit}
+    site_count = sparse.csr_matrix(np.ones((1, n_cand)))
+
+    if objective == 'p_median':
+        penalty = _unreachable_cost(distances, unreachable_cost)
+        nnz = distances.nnz
+        entries = np.arange(nnz)
+        c = np.concatenate([np.zeros(n_cand), weights[distances.col] * distances.data, weights * penalty])
+        assign = sparse.hstack([
+            sparse.csr_matrix((n_demand, n_cand)),
+            sparse.csr_matrix((np.ones(nnz), (distances.col, entries)), shape=(n_demand, nnz)),
+            sparse.identity(n_demand, format='csr'),
+        ], format='csr')
+        link = sparse.hstack([
+            sparse.csr_matrix((-np.ones(nnz), (entries, distances.row)), shape=(nnz, n_cand)),
+            sparse.identity(nnz, format='csr'),
+            sparse.csr_matrix((nnz, n_demand)),
+        ], format='csr')
+        count = sparse.hstack([site_count, sparse.csr_matrix((1, nnz + n_demand))], format='csr')
+        constraints = [LinearConstraint(assign, 1, 1), LinearConstraint(link, -np.inf, 0), LinearConstraint(count, p, p)]
+    elif objective == 'coverage':
+        within = distances.data <= radius
+        c = np.concatenate([np.zeros(n_cand), -weights])
+        cover = sparse.hstack([
+            -sparse.csr_matrix((np.ones(within.sum()), (distances.col[within], distances.row[within])),
+                               shape=(n_demand, n_cand)),
+            sparse.identity(n_demand, format='csr'),
+        ], format='csr')
+        count = sparse.hstack([site_count, sparse.csr_matrix((1, n_demand))], format='csr')
+        constraints = [LinearConstraint(cover, -np.inf, 0), LinearConstraint(count, p, p)]
+    else:
+        raise ValueError(f"未知的选址目标: {objective}")
+
+    integrality = np.zeros(len(c))
+    integrality[:n_cand] = 1
+    result = milp(c, constraints=constraints, integrality=integrality, bounds=Bounds(0, 1), options=options)
+    if result.x is None:
+        raise RuntimeError(f"MILP 求解失败: {result.message}")
+    sites = np.flatnonzero(result.x[:n_cand] > 0.5)
+    return sites, float(abs(result.fun))
+
+def solve_location(candidates: np.ndarray,
+                   demand: np.ndarray,
+                   weights: np.ndarray,
+                   p: int,
+                   objective: str = 'p_median',
+                   solver: str = 'heuristic',
+                   radius: float = COVERAGE_RADIUS_KM,
+                   k: int = NEAREST_CANDIDATES,
+                   time_limit: Optional[float] = None) -> Dict[str, Any]:
+    """
+    选址求解入口
+    参数:
+        candidates: (候选数, 2) 候选站点经纬度
+        demand: (需求点数, 2) 需求点经纬度
+        weights: 各需求点的需求量
+        p: 选址数量
+        objective: 'p_median' 或 'coverage'
+        solver: 'heuristic'（贪心 + 交换）或 'milp'
+        radius: 最大覆盖的服务半径（公里）
+        k: p_median 中每个需求点保留的最近候选数
+    返回:
+        {'sites': 选中的候选下标, 'objective': 目标值, 'assignment': 各需求点最近站点下标,
+         'distance': 各需求点到最近站点距离（公里）}
+    """
+    index = SiteIndex(candidates)
+    distances = candidate_distances(candidates, demand, k=k, index=index,
+                                    radius=radius if objective == 'coverage' else None)
+    if solver == 'milp':
+        sites, value = solve_milp(distances, weights, p, objective, radius, time_limit=time_limit)
+    elif objective == 'p_median':
+        sites, value = p_median_heuristic(distances, weights, p)
+    elif objective == 'coverage':
+        sites, value = coverage_heuristic(distances, weights, p, radius)
+    else:
+        raise ValueError(f"未知的选址目标: {objective}")
+    plan = PlanEvaluator(index, demand, weights, k=k).evaluate(sites)
+    return {'sites': sites, 'objective': value, 'assignment': plan['assignment'], 'distance': plan['distance']}
+
+def candidate_grid(demand: np.ndarray,
+                   step_deg: float = 1.0,
+                   radius_km: float = COVERAGE_RADIUS_KM) -> np.ndarray:
+    """
+    需求点周边的规则经纬度网格候选: 在需求点外包矩形内按 step_deg 取格点，只保留 radius_km 内有需求点的格点
+    """
+    demand = np.asarray(demand, dtype=float).reshape(-1, 2)
+    lon = np.arange(np.floor(demand[:, 0].min()), np.ceil(demand[:, 0].max()) + step_deg, step_deg)
+    lat = np.arange(np.floor(demand[:, 1].min()), np.ceil(demand[:, 1].max()) + step_deg, step_deg)
+    grid = np.column_stack([g.ravel() for g in np.meshgrid(lon, lat)])
+    dist, _ = SiteIndex(demand).nearest(grid, 1)
+    return grid[dist[:, 0] <= radius_km]
+
+def demand_from_predictions(predictions: pd.DataFrame,
+                            coordinates: Dict[str, Sequence[float]],
+                            years: Sequence[int],
+                            region_col: str = '省份') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    由预测结果表构建需求点
+    返回:
+        (需求点经纬度 (地区数, 2), 各年份预测需求 (地区数, 年数))；缺少坐标的地区被忽略
+    """
+    known = predictions[predictions[region_col].isin(list(coordinates))]
+    coords = np.array([coordinates[name] for name in known[region_col]], dtype=float)
+    demand = known[[str(y) for y in years]].to_numpy(dtype=float)
+    return coords, np.nan_to_num(demand)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+预测结果的读写
+
+支持 Parquet / Feather / Arrow IPC 列式格式与 Excel:
+    - 列式格式读取时可内存映射，并只加载需要的列（省份 + 指定年份）
+    - Excel 保留为导出格式，供人工查看
+"""
+import os
+import pandas as pd
+from typing import Iterable, List, Optional
+
+# 文件扩展名 -> 格式
+RESULT_FORMATS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'arrow': '.arrow',
+    'xlsx': '.xlsx',
+}
+
+# 读取时按此顺序选择已存在的文件
+READ_PREFERENCE = ('arrow', 'parquet', 'feather', 'xlsx')
+
+def _require_pyarrow():
+    """按需导入 pyarrow，未安装时给出提示"""
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError as e:
+        raise ImportError("列式格式需要安装 pyarrow（pip install pyarrow），或改用 'xlsx' 格式") from e
+
+def write_results(df: pd.DataFrame, base_path: str, formats: Iterable[str] = ('parquet', 'xlsx')) -> List[str]:
+    """
+    按指定格式写出预测结果
+    参数:
+        df: 预测结果表（列名需为字符串）
+        base_path: 不含扩展名的输出路径，如 预测结果/最终预测结果
+        formats: RESULT_FORMATS 中的格式名
+    返回:
+        写出的文件路径列表
+    说明:
+        同一 base_path 下本次未写出的其他格式文件会被删除，避免上次运行遗留的旧列式文件
+        按 READ_PREFERENCE 优先于本次较新的导出被读取
+    """
+    formats = list(formats)
+    paths = []
+    for fmt in formats:
+        if fmt not in RESULT_FORMATS:
+            raise ValueError(f"不支持的结果格式: {fmt}")
+        path = base_path + RESULT_FORMATS[fmt]
+
+        if fmt == 'xlsx':
+            df.to_excel(path, index=False)
+        else:
+            pa = _require_pyarrow()
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if fmt == 'parquet':
+                import pyarrow.parquet as pq
+                pq.write_table(table, path)
+            elif fmt == 'feather':
+                import pyarrow.feather as feather
+                feather.write_feather(table, path)
+            else:
+                # 不压缩的 Arrow IPC 文件，读取时可零拷贝内存映射
+                with pa.OSFile(path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+        paths.append(path)
+    
+    for fmt, ext in RESULT_FORMATS.items():
+        stale = base_path + ext
+        if fmt not in formats and os.path.exists(stale):
+            os.remove(stale)
+    return paths
+
+def resolve_result_path(base_path: str, preference: Iterable[str] = READ_PREFERENCE) -> str:
+    """返回按优先顺序第一个存在的结果文件；base_path 已带扩展名时原样返回"""
+    if os.path.splitext(base_path)[1].lower() in RESULT_FORMATS.values():
+        return base_path
+    for fmt in preference:
+        path = base_path + RESULT_FORMATS[fmt]
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"未找到预测结果文件: {base_path}.*")
+
+def read_results(base_path: str,
+                 years: Optional[Iterable[int]] = None,
+                 columns: Optional[List[str]] = None,
+                 memory_map: bool = True) -> pd.DataFrame:
+    """
+    读取预测结果
+    参数:
+        base_path: 结果文件路径（可不含扩展名，此时按 READ_PREFERENCE 选择已有文件）
+        years: 只读取这些年份的列（总是包含 '省份' 列）
+        columns: 直接指定要读取的列，优先于 years
+        memory_map: 列式格式是否内存映射读取
+    返回:
+        预测结果 DataFrame
+    """
+    path = resolve_result_path(base_path)
+    if columns is None and years is not None:
+        columns = ['省份'] + [str(y) for y in years]
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.xlsx':
+        df = pd.read_excel(path, usecols=columns)
+        df.columns = [str(col) for col in df.columns]
+        return df
+
+    pa = _require_pyarrow()
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    elif ext == '.feather':
+        import pyarrow.feather as feather
+        table = feather.read_table(path, columns=columns, memory_map=memory_map)
+    else:
+        # 读取后立即关闭文件/映射；内存映射读取是零拷贝的（pandas 的 Arrow 字符串列同样直接引用映射），
+        # 选列后把所需列复制到堆内存，否则返回的 DataFrame 一直占用映射，Windows 上之后覆盖或删除该文件会失败
+        with (pa.memory_map(path, 'r') if memory_map else pa.OSFile(path, 'rb')) as source:
+            table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+            if memory_map:
+                table = table.take(pa.array(range(table.num_rows)))
+    return table.to_pandas()
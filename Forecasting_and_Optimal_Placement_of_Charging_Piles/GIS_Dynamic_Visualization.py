@@ -6,6 +6,8 @@ from matplotlib.widgets import Slider
 import numpy as np
 import os
 from matplotlib.colors import LinearSegmentedColormap, LogNorm
+from Forecast_result_storage import read_results
+from Geometry_cache import load_geometry
 
 # 设置兼容中文和负号的字体
 plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']  # 使用微软雅黑
@@ -52,20 +54,20 @@ area_dict = {
     '澳门': 32.90
 }
 
-# 加载地理数据 - 使用相对路径
+# 加载地理数据 - 使用相对路径（从几何缓存读取简化后的省界，首次运行时生成缓存）
 print("正在加载地理数据...")
-china = gpd.read_file(os.path.join(script_dir, 'china.json'))
+china = load_geometry(os.path.join(script_dir, 'china.json'))
 china = china[~china['name'].isna() & (china['name'] != '')].copy().reset_index(drop=True)
 
 # 加载充电桩数据 - 使用相对路径
 print("\n正在加载充电桩数据...")
 # 历史数据文件（同一目录下）
 hist_data_path = os.path.join(script_dir, "16-22年各省份公共充电桩保有量.xlsx")
-# 预测数据文件（在预测结果子目录下）
-pred_data_path = os.path.join(script_dir, "预测结果", "最终预测结果.xlsx")
+# 预测数据文件（在预测结果子目录下，优先读取列式文件，只加载滑动条覆盖的年份）
+pred_data_path = os.path.join(script_dir, "预测结果", "最终预测结果")
 
 hist_data = pd.read_excel(hist_data_path)
-pred_data = pd.read_excel(pred_data_path)
+pred_data = read_results(pred_data_path, years=range(2023, 2031))
 
 # 数据预处理
 def preprocess_data(df):
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+地图几何缓存
+
+china.json 只在首次使用（或文件内容变化）时解析一次，之后从列式缓存读取:
+    - 缓存为 GeoParquet（或 Feather），文件名带源文件内容与简化参数的哈希，源文件或参数变化时自动重建并删除旧缓存
+    - 同时预先计算多个细节级别的简化几何；优先用覆盖简化（相邻省份共用的边界一起简化，不产生缝隙或重叠），
+      shapely 不支持时退回逐个几何的保拓扑简化；岛屿等小块默认全部保留，
+      仅在 FRAGMENT_AREA 中为某个级别设置了面积阈值时才去掉碎片（每个区域至少保留最大的一块）
+    - 同一进程内读取过的级别保存在内存中，重复绘图不再读盘
+未安装 pyarrow 时不写缓存，直接在内存中解析并简化。
+"""
+import hashlib
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from typing import Dict, Optional, Tuple
+
+# 细节级别 -> 简化容差（度）；None 表示原始精度
+LEVELS_OF_DETAIL = {
+    'full': None,
+    'medium': 0.05,
+    'low': 0.1,
+}
+# 地图脚本默认使用的细节级别
+DEFAULT_LEVEL = 'medium'
+# 细节级别 -> 去掉碎片的面积阈值（平方度）；None 表示保留所有岛屿（如海南周边岛屿、南海诸岛）
+FRAGMENT_AREA = {
+    'full': None,
+    'medium': None,
+    'low': None,
+}
+# 缓存格式: 'parquet'（GeoParquet）或 'feather'
+CACHE_FORMAT = 'parquet'
+CACHE_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather'}
+# 缓存目录名（位于源文件所在目录下）
+CACHE_DIR_NAME = 'geometry_cache'
+
+_MEMORY: Dict[Tuple[str, str, str], gpd.GeoDataFrame] = {}
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """源文件内容的 SHA-256 哈希"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def settings_hash(level: str) -> str:
+    """细节级别对应的简化参数（容差、碎片阈值）的哈希，参数修改后旧缓存不再命中"""
+    settings = json.dumps([LEVELS_OF_DETAIL[level], FRAGMENT_AREA[level]])
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+def _has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def simplify_geometry(gdf: gpd.GeoDataFrame,
+                      tolerance: Optional[float],
+                      min_fragment_area: Optional[float] = None) -> gpd.GeoDataFrame:
+    """
+    按容差简化几何；tolerance 为 None 时原样返回
+    参数:
+        min_fragment_area: 面积小于该值的碎片去掉（每个区域至少保留最大的一块）；默认 None，不去掉任何一块
+    """
+    if tolerance is None:
+        return gdf
+    geometry = gdf.geometry.values
+    if hasattr(shapely, 'coverage_simplify'):
+        geometry = shapely.coverage_simplify(geometry, tolerance)
+    else:
+        geometry = shapely.simplify(geometry, tolerance, preserve_topology=True)
+
+    if min_fragment_area is not None:
+        parts, owner = shapely.get_parts(geometry, return_index=True)
+        area = shapely.area(parts)
+        keep = area >= min_fragment_area
+        # 按 (区域, 面积) 排序后每个区域的最后一块即最大块
+        order = np.lexsort((area, owner))
+        largest = np.r_[owner[order][1:] != owner[order][:-1], True]
+        keep[order[largest]] = True
+        idx = np.flatnonzero(keep)
+        groups = np.split(parts[idx], np.searchsorted(owner[idx], np.arange(1, len(geometry))))
+        geometry = [shapely.multipolygons(group) if len(group) else geom for group, geom in zip(groups, geometry)]
+
+    simplified = gdf.copy()
+    simplified.geometry = geometry
+    return simplified
+
+def _scalar_columns(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """GeoJSON 中的列表/字典属性（如 center、parent）转为 JSON 字符串，便于写入列式格式"""
+    gdf = gdf.copy()
+    for col in gdf.columns:
+        if col == gdf.geometry.name or gdf[col].dtype != object:
+            continue
+        if gdf[col].map(lambda v: isinstance(v, (list, dict))).any():
+            gdf[col] = gdf[col].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v)
+    return gdf
+
+def cache_paths(source: str, digest: str, cache_dir: Optional[str] = None, fmt: str = CACHE_FORMAT) -> Dict[str, str]:
+    """各细节级别的缓存文件路径"""
+    if fmt not in CACHE_EXTENSIONS:
+        raise ValueError(f"不支持的缓存格式: {fmt}")
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source)), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return {level: os.path.join(cache_dir,
+                                f"{stem}_{digest[:16]}_{level}_{settings_hash(level)[:8]}{CACHE_EXTENSIONS[fmt]}")
+            for level in LEVELS_OF_DETAIL}
+
+def build_cache(source: str, cache_dir: Optional[str] = None, fmt: str = CACHE_FORMAT) -> Dict[str, str]:
+    """
+    解析源文件一次，写出所有细节级别的缓存，并删除同一源文件旧哈希的缓存
+    返回:
+        细节级别 -> 缓存文件路径
+    """
+    digest = file_hash(source)
+    paths = cache_paths(source, digest, cache_dir, fmt)
+    folder = os.path.dirname(next(iter(paths.values())))
+    os.makedirs(folder, exist_ok=True)
+
+    full = _scalar_columns(gpd.read_file(source))
+    for level, tolerance in LEVELS_OF_DETAIL.items():
+        gdf = simplify_geometry(full, tolerance, FRAGMENT_AREA[level])
+        if fmt == 'parquet':
+            gdf.to_parquet(paths[level], index=False)
+        else:
+            gdf.to_feather(paths[level], index=False)
+
+    stem = os.path.splitext(os.path.basename(source))[0] + '_'
+    current = {os.path.basename(p) for p in paths.values()}
+    for name in os.listdir(folder):
+        if name.startswith(stem) and name.endswith(CACHE_EXTENSIONS[fmt]) and name not in current:
+            os.remove(os.path.join(folder, name))
+    return paths
+
+def load_geometry(source: str,
+                  level: str = DEFAULT_LEVEL,
+                  cache_dir: Optional[str] = None,
+                  fmt: str = CACHE_FORMAT) -> gpd.GeoDataFrame:
+    """
+    读取地图几何
+    参数:
+        source: GeoJSON 源文件路径（如 china.json）
+        level: LEVELS_OF_DETAIL 中的细节级别
+        cache_dir: 缓存目录，默认为源文件旁的 geometry_cache
+        fmt: 缓存格式
+    返回:
+        GeoDataFrame（副本，调用方可自由修改）
+    """
+    if level not in LEVELS_OF_DETAIL:
+        raise ValueError(f"未知的细节级别: {level}")
+    source = os.path.abspath(source)
+    digest = file_hash(source)
+    key = (source, digest, level)
+    if key not in _MEMORY:
+        if _has_pyarrow():
+            path = cache_paths(source, digest, cache_dir, fmt)[level]
+            if not os.path.exists(path):
+                build_cache(source, cache_dir, fmt)
+            _MEMORY[key] = gpd.read_parquet(path) if fmt == 'parquet' else gpd.read_feather(path)
+        else:
+            _MEMORY[key] = simplify_geometry(gpd.read_file(source), LEVELS_OF_DETAIL[level], FRAGMENT_AREA[level])
+    return _MEMORY[key].copy()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+全局面板模型
+
+所有省份共用一个模型，替代逐省份拟合的混合预测:
+    - 特征张量 (省份, 年份, 特征) 一次向量化构建: 本省对数增长率滞后、邻省（空间权重）增长率滞后、
+      上年对数保有量、相对容量上限的饱和度、政策系数
+    - 目标为当年对数增长率；模型可选梯度提升树、随机森林或混合面板VAR（最小二乘）
+    - 预测时每一步对所有省份一次批量预测，再递推下一步的滞后特征
+"""
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from typing import Any, Dict, List
+
+import ARIMA_randon_forest_predict as provincial
+from Model_registry import get_backend
+
+# 模型: 'gbr'（梯度提升树）/ 'rf'（随机森林）/ 'pooled_var'（混合面板VAR，含邻省滞后项）
+GLOBAL_MODEL = 'gbr'
+# 增长率滞后阶数
+GLOBAL_LAGS = 2
+GLOBAL_MODEL_PARAMS = {
+    'gbr': {'n_estimators': 300, 'max_depth': 3, 'learning_rate': 0.05, 'subsample': 0.8, 'random_state': 42},
+    'rf': {'n_estimators': 300, 'max_depth': 6, 'random_state': 42, 'n_jobs': -1},
+}
+
+def _static_features(provinces: List[str]) -> np.ndarray:
+    """不随时间变化的特征: (对数容量上限, 政策系数)，形状 (省份数, 2)"""
+    return np.column_stack([
+        [np.log(provincial.PROVINCE_CAPACITY.get(p, 1000000)) for p in provinces],
+        [provincial.PROVINCE_POLICY.get(p, 1.0) for p in provinces],
+    ])
+
+def feature_tensor(log_levels: np.ndarray,
+                   weight_matrix: sparse.csr_matrix,
+                   static: np.ndarray,
+                   lags: int = GLOBAL_LAGS) -> np.ndarray:
+    """
+    构建特征张量
+    参数:
+        log_levels: (省份数, 年份数) 对数保有量
+        weight_matrix: 行标准化的空间权重矩阵
+        static: (省份数, 2) 对数容量上限与政策系数
+    返回:
+        (省份数, 年份数-lags, 特征数) 张量，第 j 个位置的特征只用到第 lags+j 年之前的数据，
+        用于预测第 lags+j 年（对数增长率序列中的下标）的增长率
+    """
+    growth = np.diff(log_levels, axis=1)
+    neighbor_growth = np.asarray(weight_matrix @ growth)
+    n_rows, n_growth = growth.shape
+    n_samples = n_growth - lags + 1
+    own = np.stack([growth[:, lags - k:lags - k + n_samples] for k in range(1, lags + 1)], axis=2)
+    neighbor = np.stack([neighbor_growth[:, lags - k:lags - k + n_samples] for k in range(1, lags + 1)], axis=2)
+    level = log_levels[:, lags:lags + n_samples, None]
+    saturation = level - static[:, None, 0:1]
+    policy = np.broadcast_to(static[:, None, 1:2], (n_rows, n_samples, 1))
+    return np.concatenate([own, neighbor, level, saturation, policy], axis=2)
+
+def fit_global_model(log_levels: np.ndarray,
+                     weight_matrix: sparse.csr_matrix,
+                     static: np.ndarray,
+                     model: str = GLOBAL_MODEL,
+                     lags: int = GLOBAL_LAGS) -> Dict[str, Any]:
+    """在所有省份 × 年份样本上训练一个模型，返回 {'model', 'estimator', 'lags'}"""
+    features = feature_tensor(log_levels, weight_matrix, static, lags)
+    growth = np.diff(log_levels, axis=1)
+    # 最后一个位置的特征用于预测下一年，没有对应的目标
+    X = features[:, :-1].reshape(-1, features.shape[2])
+    y = growth[:, lags:].ravel()
+    valid = np.isfinite(X).all(axis=1) & np.isfinite(y)
+    X, y = X[valid], y[valid]
+
+    if model == 'pooled_var':
+        design = np.column_stack([np.ones(len(X)), X])
+        estimator, *_ = np.linalg.lstsq(design, y, rcond=None)
+    elif model in ('gbr', 'rf'):
+        backend = 'gradient_boosting' if model == 'gbr' else 'random_forest'
+        estimator = get_backend(backend)(**GLOBAL_MODEL_PARAMS[model])
+        estimator.fit(X, y)
+    else:
+        raise ValueError(f"未知的全局模型: {model}")
+    return {'model': model, 'estimator': estimator, 'lags': lags, 'n_samples': len(y)}
+
+def _predict_growth(fitted: Dict[str, Any], X: np.ndarray) -> np.ndarray:
+    if fitted['model'] == 'pooled_var':
+        return fitted['estimator'][0] + X @ fitted['estimator'][1:]
+    return fitted['estimator'].predict(X)
+
+def global_forecast(fitted: Dict[str, Any],
+                    log_levels: np.ndarray,
+                    weight_matrix: sparse.csr_matrix,
+                    static: np.ndarray,
+                    steps: int = 8) -> np.ndarray:
+    """
+    递推预测: 每一步对所有省份构建最新一期特征并一次批量预测
+    返回:
+        (省份数, 预测步数) 保有量预测（未后处理）
+    """
+    lags = fitted['lags']
+    levels = log_levels
+    for _ in range(steps):
+        # 只需最近 lags+1 年即可构建下一年的特征
+        latest = feature_tensor(levels[:, -(lags + 1):], weight_matrix, static, lags)[:, -1]
+        next_growth = np.nan_to_num(_predict_growth(fitted, latest))
+        levels = np.column_stack([levels, levels[:, -1] + next_growth])
+    return np.exp(levels[:, -steps:])
+
+def run_global_forecasts(panel: pd.DataFrame,
+                         provinces: List[str],
+                         weight_matrix: sparse.csr_matrix,
+                         steps: int = 8,
+                         model: str = GLOBAL_MODEL) -> Dict[str, Dict[str, Any]]:
+    """
+    全局模型预测，返回结构与 run_forecasts 相同（省份 -> 预测结果字典），可直接接入 main 的后续流程
+    """
+    start = time.time()
+    years = list(panel.columns)
+    values = panel.reindex(provinces).to_numpy(dtype=float)
+    series = [provincial.preprocess_series(row, years, p) for p, row in zip(provinces, values)]
+    log_levels = np.log(np.maximum(np.vstack([s.values for s in series]), 1.0))
+    static = _static_features(provinces)
+
+    try:
+        fitted = fit_global_model(log_levels, weight_matrix, static, model=model)
+        raw = global_forecast(fitted, log_levels, weight_matrix, static, steps)
+    except Exception as e:
+        print(f"全局模型预测失败: {str(e)}")
+        return {p: {'province': p, 'forecast': None, 'error': str(e)} for p in provinces}
+
+    bounds = np.array([provincial.postprocess_bounds(s, p) for s, p in zip(series, provinces)], dtype=float)
+    processed = provincial.postprocess_forecasts(raw, floors=bounds[:, 0], caps=bounds[:, 1], min_growth=bounds[:, 2])
+    elapsed = time.time() - start
+    print(f"全局模型({model})训练样本 {fitted['n_samples']} 个，{len(provinces)} 个省份预测耗时 {elapsed:.2f} 秒")
+
+    record = {'tier': 'global', 'model': model, 'n_obs': len(years)}
+    return {
+        p: {
+            'province': p,
+            'forecast': processed[i],
+            'raw_forecast': raw[i],
+            'history': series[i].values,
+            'bounds': tuple(bounds[i]),
+            'record': dict(record),
+            'timings': {'global': elapsed},
+            'error': None,
+        }
+        for i, p in enumerate(provinces)
+    }
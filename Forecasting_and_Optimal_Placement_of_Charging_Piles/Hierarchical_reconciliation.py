@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+层级预测协调
+
+全国 Chargers 预测（Predict_and_test）与各省份预测（ARIMA_randon_forest_predict）分别建模，加总不一致。
+本模块用稀疏求和矩阵 S 描述层级（全国 → 省份，之后可扩展到 → 城市），将各层的基础预测协调为一致预测:
+    - bottom_up: 只用叶节点预测向上加总
+    - top_down: 顶层预测按历史平均占比向下分配
+    - ols / wls_struct / mint_shrink: 投影法 ỹ = ŷ - W C'(C W C')⁻¹ C ŷ，C = [I, -A] 为加总约束矩阵
+其中 mint_shrink 的 W 为样本内残差协方差向对角阵收缩的估计，以 对角阵 + 低秩项 形式保存，
+全程只出现 (节点数 × 预测步数)、(汇总节点数 × 汇总节点数) 与 (年份数 × 节点数) 大小的矩阵，
+叶节点达到数万个时也不会构造稠密的 节点数 × 节点数 矩阵。
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+from typing import Dict, List, Optional, Sequence, Tuple
+
+RECONCILIATION_METHODS = ('bottom_up', 'top_down', 'ols', 'wls_struct', 'mint_shrink')
+
+def summing_matrix(leaves: Sequence[str],
+                   ancestors: Dict[str, Sequence[str]]) -> Tuple[List[str], sparse.csr_matrix]:
+    """
+    构建稀疏求和矩阵
+    参数:
+        leaves: 叶节点名称（如省份，之后可为城市）
+        ancestors: 叶节点 -> 其所属的各汇总节点（自上而下，如 ('全国',) 或 ('全国', '广东')）
+    返回:
+        (节点名称列表, S)，节点顺序为汇总节点（按首次出现）在前、叶节点在后；
+        S 形状为 (节点数, 叶节点数)，下方为单位阵
+    """
+    leaves = list(leaves)
+    aggregates: Dict[str, int] = {}
+    rows, cols = [], []
+    for j, leaf in enumerate(leaves):
+        for node in ancestors.get(leaf, ()):
+            rows.append(aggregates.setdefault(node, len(aggregates)))
+            cols.append(j)
+    aggregation = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(aggregates), len(leaves)))
+    S = sparse.vstack([aggregation, sparse.identity(len(leaves), format='csr')], format='csr')
+    return list(aggregates) + leaves, S
+
+def _split(S: sparse.csr_matrix) -> Tuple[int, sparse.csr_matrix]:
+    """汇总节点数与加总矩阵 A（S 的上半部分）"""
+    n_agg = S.shape[0] - S.shape[1]
+    return n_agg, S[:n_agg]
+
+def constraint_matrix(S: sparse.csr_matrix) -> sparse.csr_matrix:
+    """加总约束矩阵 C = [I, -A]，一致预测满足 C @ y = 0"""
+    n_agg, aggregation = _split(S)
+    return sparse.hstack([sparse.identity(n_agg, format='csr'), -aggregation], format='csr')
+
+def one_step_residuals(history: np.ndarray) -> np.ndarray:
+    """
+    样本内一步预测残差（对数漂移模型: 上一年值 × 历史平均增长倍数），用于估计 mint_shrink 的协方差
+    参数:
+        history: (节点数, 年数) 各节点的历史数据，顺序与 summing_matrix 的节点顺序一致
+    返回:
+        (年数-1, 节点数) 残差矩阵
+    """
+    history = np.asarray(history, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_growth = np.log(history[:, 1:] / history[:, :-1])
+    log_growth[~np.isfinite(log_growth)] = np.nan
+    drift = np.nan_to_num(np.nanmean(log_growth, axis=1))
+    fitted = history[:, :-1] * np.exp(drift)[:, None]
+    return np.nan_to_num(history[:, 1:] - fitted).T
+
+def shrinkage_covariance(residuals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    残差协方差向对角阵收缩（Schäfer-Strimmer 收缩强度），W = diag(d) + coef * U'U
+    参数:
+        residuals: (样本数, 节点数) 残差矩阵，样本数至少为 2
+    返回:
+        (d, U, coef)；收缩强度 λ 由 (样本数 × 样本数) 的 Gram 矩阵算出，不构造 节点数 × 节点数 矩阵
+    """
+    R = np.asarray(residuals, dtype=float)
+    T = R.shape[0]
+    if T < 2:
+        raise ValueError("mint_shrink 至少需要 2 期样本内残差")
+    variance = (R ** 2).mean(axis=0)
+    # 方差为零的节点（如常数序列）给一个很小的下限，保证 C W C' 可逆
+    floor = max(variance.mean(), 1.0) * 1e-8
+    variance = np.maximum(variance, floor)
+    xs = R / np.sqrt(variance)
+    sq = xs ** 2
+    gram = xs @ xs.T
+    gram_sq = np.sum(gram ** 2)
+    col_sq = sq.sum(axis=0)
+    # 相关系数非对角元的方差之和与平方和
+    var_sum = (np.sum(sq.sum(axis=1) ** 2) - np.sum(sq ** 2)
+               - (gram_sq - np.sum(col_sq ** 2)) / T) / (T * (T - 1))
+    corr_sum = (gram_sq - np.sum(col_sq ** 2)) / T ** 2
+    lam = 1.0 if corr_sum <= 0 else float(np.clip(var_sum / corr_sum, 0.0, 1.0))
+    return lam * variance, R / np.sqrt(T), 1.0 - lam
+
+def _apply_weights(d: np.ndarray, U: Optional[np.ndarray], coef: float, M) -> np.ndarray:
+    """计算 W @ M，M 可为稀疏矩阵"""
+    result = sparse.diags(d) @ M
+    result = result.toarray() if sparse.issparse(result) else np.asarray(result)
+    if U is not None and coef > 0:
+        UM = U @ M
+        result = result + coef * (U.T @ (UM.toarray() if sparse.issparse(UM) else UM))
+    return result
+
+def projection_reconcile(base: np.ndarray,
+                         S: sparse.csr_matrix,
+                         d: np.ndarray,
+                         U: Optional[np.ndarray] = None,
+                         coef: float = 0.0) -> np.ndarray:
+    """
+    投影法协调: ỹ = ŷ - W C'(C W C')⁻¹ C ŷ，W = diag(d) + coef * U'U
+    无低秩项时 C W C' 为稀疏矩阵，用稀疏 LU 分解求解；否则为 (汇总节点数 × 汇总节点数) 稠密矩阵
+    """
+    C = constraint_matrix(S)
+    discrepancy = C @ base
+    if U is None or coef <= 0:
+        system = (C @ sparse.diags(d) @ C.T).tocsc()
+        correction = sparse_linalg.splu(system).solve(np.asarray(discrepancy))
+    else:
+        CU = np.asarray((C @ U.T))
+        system = (C @ sparse.diags(d) @ C.T).toarray() + coef * (CU @ CU.T)
+        correction = np.linalg.solve(system, discrepancy)
+    return base - _apply_weights(d, U, coef, C.T @ correction)
+
+def top_down_proportions(S: sparse.csr_matrix, leaf_history: np.ndarray) -> np.ndarray:
+    """叶节点占顶层节点（节点 0）的历史平均占比，各叶节点之和为 1"""
+    totals = np.nansum(np.asarray(leaf_history, dtype=float), axis=1)
+    n_agg, aggregation = _split(S)
+    top = aggregation[0] @ totals if n_agg else totals.sum()
+    return totals / top if top > 0 else np.full(S.shape[1], 1.0 / S.shape[1])
+
+def reconcile(base: np.ndarray,
+              S: sparse.csr_matrix,
+              method: str = 'mint_shrink',
+              history: Optional[np.ndarray] = None,
+              residuals: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    协调各层基础预测
+    参数:
+        base: (节点数, 预测步数) 基础预测，行顺序与 summing_matrix 返回的节点顺序一致
+        S: 稀疏求和矩阵
+        method: RECONCILIATION_METHODS 之一
+        history: (节点数, 年数) 历史数据；top_down 用于计算占比，mint_shrink 未给出 residuals 时用于计算残差
+        residuals: (样本数, 节点数) 样本内残差，mint_shrink 使用
+    返回:
+        (节点数, 预测步数) 一致预测，满足 S @ 叶节点预测 == 全部节点预测
+    """
+    base = np.atleast_2d(np.asarray(base, dtype=float))
+    n_agg, aggregation = _split(S)
+
+    if method == 'bottom_up':
+        return np.asarray(S @ base[n_agg:])
+    if method == 'top_down':
+        if history is None:
+            raise ValueError("top_down 需要提供历史数据 history")
+        proportions = top_down_proportions(S, np.asarray(history)[n_agg:])
+        return np.asarray(S @ (proportions[:, None] * base[0]))
+    if method == 'ols':
+        return projection_reconcile(base, S, np.ones(S.shape[0]))
+    if method == 'wls_struct':
+        return projection_reconcile(base, S, np.asarray(S.sum(axis=1)).ravel())
+    if method == 'mint_shrink':
+        if residuals is None:
+            if history is None:
+                raise ValueError("mint_shrink 需要提供 residuals 或 history")
+            residuals = one_step_residuals(history)
+        d, U, coef = shrinkage_covariance(residuals)
+        return projection_reconcile(base, S, d, U, coef)
+    raise ValueError(f"未知的协调方法: {method}")
+
+# 全国层基础预测所用的模型（Predict_and_test.get_forecasts 中 Chargers_<模型> 列取均值）及单位换算（万台 -> 台）
+NATIONAL_NODE = '全国'
+NATIONAL_FORECAST_MODELS = ('Prophet', 'VAR', 'RF')
+NATIONAL_UNIT_SCALE = 10000
+
+def national_series(years: Sequence[int]) -> np.ndarray:
+    """
+    全国公共充电桩保有量（台）: 有实际数据的年份用实际值，其余年份用 NATIONAL_FORECAST_MODELS 预测均值，
+    两者都没有的年份为 NaN
+    """
+    import Predict_and_test as national
+    actual = national.df['Chargers']
+    values = {int(ts.year): v for ts, v in actual.items()}
+    # 只有需要预测年份时才拟合全国模型
+    if any(int(y) not in values for y in years):
+        forecasts = national.get_forecasts()
+        columns = [f'Chargers_{model}' for model in NATIONAL_FORECAST_MODELS]
+        for ts, v in forecasts[columns].mean(axis=1).items():
+            values.setdefault(int(ts.year), v)
+    return np.array([values.get(int(y), np.nan) for y in years], dtype=float) * NATIONAL_UNIT_SCALE
+
+def reconcile_national_provincial(provinces: Sequence[str],
+                                  forecasts: np.ndarray,
+                                  history: np.ndarray,
+                                  forecast_years: Sequence[int],
+                                  history_years: Sequence[int],
+                                  method: str = 'mint_shrink') -> Tuple[List[str], np.ndarray]:
+    """
+    全国 → 省份 两层协调
+    参数:
+        forecasts: (省份数, 预测步数) 省份预测
+        history: (省份数, 年数) 省份历史数据（缺失为 NaN）
+    返回:
+        (节点名称列表, (节点数, 预测步数) 一致预测)，第一行为全国
+    说明:
+        全国层缺少基础预测的年份以省份预测之和代替；全国历史缺失的年份同样以省份之和代替
+    """
+    nodes, S = summing_matrix(provinces, {p: (NATIONAL_NODE,) for p in provinces})
+    history = np.nan_to_num(np.asarray(history, dtype=float))
+    forecasts = np.asarray(forecasts, dtype=float)
+    national_base = national_series(forecast_years)
+    national_history = national_series(history_years)
+    base = np.vstack([np.where(np.isnan(national_base), forecasts.sum(axis=0), national_base), forecasts])
+    full_history = np.vstack([np.where(np.isnan(national_history), history.sum(axis=0), national_history), history])
+    return nodes, reconcile(base, S, method, history=full_history)
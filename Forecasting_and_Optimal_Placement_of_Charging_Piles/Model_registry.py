@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+模型后端注册表
+
+statsmodels / pmdarima / prophet / sklearn / libpysal 等重量级依赖在首次使用时才导入，
+导入预测脚本本身不再加载这些依赖。也可通过 register_backend 替换某个后端（如测试时换成轻量实现）。
+"""
+import importlib
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# 名称 -> (模块, 属性)；属性为 None 时返回模块本身
+DEFAULT_BACKENDS = {
+    'arima': ('statsmodels.tsa.arima.model', 'ARIMA'),
+    'auto_arima': ('pmdarima', 'auto_arima'),
+    'adfuller': ('statsmodels.tsa.stattools', 'adfuller'),
+    'var': ('statsmodels.tsa.api', 'VAR'),
+    'prophet': ('prophet', 'Prophet'),
+    'random_forest': ('sklearn.ensemble', 'RandomForestRegressor'),
+    'gradient_boosting': ('sklearn.ensemble', 'GradientBoostingRegressor'),
+    'mape': ('sklearn.metrics', 'mean_absolute_percentage_error'),
+    'spatial_weights': ('libpysal.weights', None),
+    'ball_tree': ('sklearn.neighbors', 'BallTree'),
+}
+
+_LOADERS: Dict[str, Callable[[], Any]] = {}
+_LOADED: Dict[str, Any] = {}
+_LOCK = threading.RLock()
+
+def _import_loader(module: str, attr: Optional[str]) -> Callable[[], Any]:
+    def load():
+        mod = importlib.import_module(module)
+        return getattr(mod, attr) if attr else mod
+    return load
+
+def register_backend(name: str, loader: Callable[[], Any]) -> None:
+    """注册（或替换）后端，loader 为无参可调用对象，在首次 get_backend 时调用"""
+    with _LOCK:
+        _LOADERS[name] = loader
+        _LOADED.pop(name, None)
+
+def get_backend(name: str) -> Any:
+    """取得后端对象，首次调用时加载并缓存"""
+    with _LOCK:
+        if name not in _LOADED:
+            if name not in _LOADERS:
+                raise KeyError(f"未注册的模型后端: {name}")
+            _LOADED[name] = _LOADERS[name]()
+        return _LOADED[name]
+
+def loaded_backends() -> Dict[str, Any]:
+    """已加载的后端（用于检查导入开销）"""
+    with _LOCK:
+        return dict(_LOADED)
+
+for _name, (_module, _attr) in DEFAULT_BACKENDS.items():
+    register_backend(_name, _import_loader(_module, _attr))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+多期选址与充电桩分配
+
+按预测年份逐年规划充电桩的分期建设，输出 站点 × 年份 的建设计划:
+    - 需求按地区容量上限（如 PROVINCE_CAPACITY）截断
+    - 每年逐步增加站点数，直到选中站点的容量之和 × 目标利用率不小于需求总量（各候选容量可不同）；
+      已建站点保留（fixed），只以上一年的解为起点做增量的贪心补点与交换改进，不从头求解
+    - 需求按距离由近到远分配到有剩余容量的已建站点（同一轮内对所有需求点向量化按比例分配），
+      近邻站点容量不足时按未满足需求由多到少补建近邻候选，直到补建容量覆盖缺口；站点已安装的充电桩数只增不减
+候选 × 需求 稀疏距离矩阵与需求点的近邻候选在整个规划期内只计算一次。
+"""
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from Facility_location import GREEDY_STEPS, NEAREST_CANDIDATES, candidate_distances, p_median_heuristic
+
+# 单个站点可容纳的最大充电桩数
+SITE_CAPACITY = 50000
+# 目标利用率: 每年站点数按 需求总量 / (单站容量 × 利用率) 确定，为就近分配留出余量
+TARGET_UTILISATION = 0.8
+# 每年增量交换改进的最大轮数（以上一年的解为起点，通常只需少量交换）
+INCREMENTAL_SWAPS = 20
+# 近邻站点容量不足时按未满足需求补建站点的最多轮数
+MAX_TOP_UPS = 10
+
+def capped_demand(demand: np.ndarray,
+                  regions: Optional[Sequence[str]] = None,
+                  region_caps: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    按地区容量上限等比例压缩需求
+    参数:
+        demand: (需求点数, 年数) 预测需求
+        regions: 各需求点所属地区
+        region_caps: 地区 -> 容量上限，未列出的地区不设上限
+    """
+    demand = np.asarray(demand, dtype=float)
+    if regions is None or not region_caps:
+        return demand
+    labels, codes = np.unique(np.asarray(regions), return_inverse=True)
+    caps = np.array([region_caps.get(label, np.inf) for label in labels], dtype=float)
+    totals = np.stack([np.bincount(codes, weights=demand[:, t], minlength=len(labels))
+                       for t in range(demand.shape[1])], axis=1)
+    scale = np.minimum(1.0, np.divide(caps[:, None], totals, out=np.ones_like(totals), where=totals > 0))
+    return demand * scale[codes]
+
+def allocate_capacity(demand: np.ndarray,
+                      neighbor_idx: np.ndarray,
+                      is_open: np.ndarray,
+                      spare: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按近邻顺序将需求分配到有剩余容量的站点
+    参数:
+        demand: 各需求点的需求
+        neighbor_idx: (需求点数, k) 各需求点按距离升序的候选下标
+        is_open: 站点是否已建
+        spare: 各站点的剩余容量（不修改）
+    返回:
+        (各站点新分配的需求量, 各需求点被满足的需求量)；k 个近邻都无剩余容量的需求不分配
+    说明:
+        第 r 轮把所有剩余需求同时请求到各自第 r 近的已建站点，请求超过剩余容量时按比例满足
+    """
+    remaining = np.asarray(demand, dtype=float).copy()
+    spare = np.asarray(spare, dtype=float).copy()
+    allocated = np.zeros(len(spare))
+    for r in range(neighbor_idx.shape[1]):
+        site = neighbor_idx[:, r]
+        active = is_open[site] & (remaining > 0)
+        if not active.any():
+            continue
+        request = np.bincount(site[active], weights=remaining[active], minlength=len(spare))
+        ratio = np.divide(spare, request, out=np.zeros_like(spare), where=request > 0).clip(max=1.0)
+        granted = remaining[active] * ratio[site[active]]
+        remaining[active] -= granted
+        used = np.bincount(site[active], weights=granted, minlength=len(spare))
+        spare -= used
+        allocated += used
+    return allocated, np.asarray(demand, dtype=float) - remaining
+
+def multi_period_plan(candidates: np.ndarray,
+                      demand_points: np.ndarray,
+                      demand: np.ndarray,
+                      years: Sequence[int],
+                      site_capacity: Any = SITE_CAPACITY,
+                      regions: Optional[Sequence[str]] = None,
+                      region_caps: Optional[Dict[str, float]] = None,
+                      existing: Optional[Sequence[int]] = None,
+                      k: int = NEAREST_CANDIDATES,
+                      max_swaps: int = INCREMENTAL_SWAPS) -> Dict[str, Any]:
+    """
+    逐年增量规划
+    参数:
+        candidates: (候选数, 2) 候选站点经纬度
+        demand_points: (需求点数, 2) 需求点经纬度
+        demand: (需求点数, 年数) 各年份预测需求（充电桩台数）
+        years: 与 demand 列对应的年份
+        site_capacity: 单站容量（标量或每个候选一个值）
+        regions / region_caps: 见 capped_demand
+        existing: 规划期前已建成的站点
+        k: 每个需求点考虑的最近候选数（同时用于选址与分配）
+        max_swaps: 每年交换改进的最大轮数
+    返回:
+        {'schedule': 站点 × 年份 的累计充电桩数表（含经纬度、是否既有站点与建设年份，既有站点的建设年份为空）,
+         'sites': 年份 -> 当年已建站点下标, 'unserved': 年份 -> 未分配的需求量}
+    """
+    candidates = np.asarray(candidates, dtype=float)
+    n_cand = len(candidates)
+    capacity = np.broadcast_to(np.asarray(site_capacity, dtype=float), (n_cand,))
+    demand = capped_demand(demand, regions, region_caps)
+
+    distances = candidate_distances(candidates, demand_points, k=k)
+    # knn_matrix 按需求点顺序、每个需求点内按距离升序排列元素
+    neighbor_idx = distances.row.reshape(len(demand), -1)
+
+    built = np.zeros(n_cand, dtype=bool)
+    if existing is not None:
+        built[np.asarray(existing, dtype=int)] = True
+    is_existing = built.copy()
+    installed = np.zeros(n_cand)
+    served = np.zeros(len(demand))
+    # 规划期内新建站点的建设年份；既有站点为 NaN
+    build_year = np.full(n_cand, np.nan)
+    cumulative, sites, unserved = {}, {}, {}
+
+    for t, year in enumerate(years):
+        weights = demand[:, t]
+        # 增量: 已建站点固定，只在上一年的解上补点与交换；按选中站点的实际容量逐步增加站点数
+        open_sites = np.flatnonzero(built)
+        required = weights.sum() / TARGET_UTILISATION
+        while len(open_sites) < n_cand:
+            shortfall = required - capacity[open_sites].sum()
+            if shortfall <= 0:
+                break
+            closed = np.ones(n_cand, dtype=bool)
+            closed[open_sites] = False
+            p = min(n_cand, len(open_sites) + max(1, int(np.ceil(shortfall / capacity[closed].mean()))))
+            open_sites, _ = p_median_heuristic(distances, weights, p, initial=open_sites,
+                                               fixed=np.flatnonzero(built), max_swaps=max_swaps,
+                                               greedy_steps=GREEDY_STEPS)
+        is_open = np.zeros(n_cand, dtype=bool)
+        is_open[open_sites] = True
+        build_year[is_open & ~built] = year
+        built = is_open.copy()
+
+        # 各需求点尚未满足的增量按近邻分配到有剩余容量的站点；近邻站点容量不足时，
+        # 按未满足需求补建近邻候选后再分配
+        for _ in range(MAX_TOP_UPS + 1):
+            shortfall = np.maximum(weights - served, 0.0)
+            added, granted = allocate_capacity(shortfall, neighbor_idx, built, capacity - installed)
+            installed += added
+            served += granted
+            shortfall -= granted
+            pull = np.bincount(neighbor_idx.ravel(), weights=np.repeat(shortfall, neighbor_idx.shape[1]),
+                               minlength=n_cand)
+            pull[built] = 0.0
+            order = np.argsort(-pull, kind='stable')[:np.count_nonzero(pull > 0)]
+            if shortfall.sum() <= 0 or len(order) == 0:
+                break
+            # 按未满足需求由多到少补建，直到补建容量覆盖缺口
+            n_new = min(len(order), int(np.searchsorted(np.cumsum(capacity[order]), shortfall.sum())) + 1)
+            new_sites = order[:n_new]
+            built[new_sites] = True
+            build_year[new_sites] = year
+        cumulative[year] = installed.copy()
+        sites[year] = np.flatnonzero(built)
+        unserved[year] = float(np.maximum(weights - served, 0.0).sum())
+
+    used = np.flatnonzero(built)
+    schedule = pd.DataFrame({
+        '候选下标': used,
+        '经度': candidates[used, 0],
+        '纬度': candidates[used, 1],
+        '既有站点': is_existing[used],
+        '建设年份': build_year[used],
+        **{str(year): np.round(cumulative[year][used]) for year in years},
+    })
+    return {'schedule': schedule, 'sites': sites, 'unserved': unserved}
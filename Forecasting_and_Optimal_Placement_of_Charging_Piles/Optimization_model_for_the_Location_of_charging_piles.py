@@ -1,14 +1,17 @@
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import os
 from matplotlib import font_manager
-from pyswarm import pso
-
-# 设置环境变量，避免 KMeans 内存泄漏
-os.environ['OMP_NUM_THREADS'] = '1'
+from Particle_swarm import batched_pso, multi_start_pso
+from Facility_location import candidate_grid, demand_from_predictions, solve_location
+from Multi_period_siting import multi_period_plan
+from Province_config import PROVINCE_CAPACITY
+from Spatial_index import haversine_km
+from Forecast_result_storage import read_results
+from Geometry_cache import load_geometry
 
 # 预定义各省份的经纬度数据
 province_coordinates = {
@@ -45,15 +48,23 @@ province_coordinates = {
     "新疆维吾尔自治区": [87.6168, 43.8256]
 }
 
+# 需求加权选址: 规划年份、目标（'p_median' / 'coverage'）与求解方式（'heuristic' / 'milp'）
+FORECAST_YEARS = list(range(2023, 2031))
+LOCATION_OBJECTIVE = 'p_median'
+LOCATION_SOLVER = 'heuristic'
+# 多期选址: 单站容量（台）与候选网格间距（度）
+SITE_CAPACITY = 50000
+CANDIDATE_GRID_STEP = 1.0
+
 # 获取当前文件的目录
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-# 读取预测结果
-def load_predictions():
+# 读取预测结果（优先读取列式文件，years 指定时只加载这些年份的列）
+def load_predictions(years=None):
     # 使用相对路径访问文件
-    file_path = os.path.join(current_dir, "预测结果", "最终预测结果.xlsx")
+    file_path = os.path.join(current_dir, "预测结果", "最终预测结果")
     try:
-        predictions_df = pd.read_excel(file_path)
+        predictions_df = read_results(file_path, years=years)
         return predictions_df
     except FileNotFoundError:
         print(f"错误: 文件 '{file_path}' 不存在，请检查路径。")
@@ -89,45 +100,136 @@ def adjust_province_name(name):
     else:
         return name + "省"  # 其他省份补充“省”
 
+# 空间聚类: 点数超过该值时改用 MiniBatchKMeans，以及小批量大小
+MINI_BATCH_THRESHOLD = 10000
+MINI_BATCH_SIZE = 4096
+
 # 空间聚类（K-Means）
-def spatial_clustering(data, n_clusters=5):
+def spatial_clustering(data, n_clusters=5, weights=None, init_centers=None, random_state=42):
+    """
+    参数:
+        data: 含 '经度'、'纬度' 列的需求点表，结果写入 'cluster' 列
+        weights: 各需求点的预测需求，作为 sample_weight（None 表示等权）
+        init_centers: 初始聚类中心（如上一年的结果），给出时只做一次热启动拟合
+    返回:
+        (data, 聚类中心)
+    说明:
+        不再全局设置 OMP_NUM_THREADS=1，KMeans 使用全部核心；点数较多时改用 MiniBatchKMeans
+    """
     # 提取经纬度数据
     coords = data[['经度', '纬度']].values
+    init = 'k-means++' if init_centers is None else np.asarray(init_centers, dtype=float)
+    n_init = 'auto' if init_centers is None else 1
     
     # 使用 K-Means 进行聚类
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    data['cluster'] = kmeans.fit_predict(coords)
+    if len(coords) > MINI_BATCH_THRESHOLD:
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_init,
+                                 batch_size=MINI_BATCH_SIZE, random_state=random_state)
+    else:
+        kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=n_init, random_state=random_state)
+    data['cluster'] = kmeans.fit_predict(coords, sample_weight=weights)
     
     # 计算每个聚类的中心点
     cluster_centers = kmeans.cluster_centers_
     return data, cluster_centers
 
-# 粒子群优化算法（PSO）
-def pso_optimization_per_cluster(cluster_centers, n_stations=1):
-    # 定义目标函数
-    def evaluate(individual, cluster_center):
-        # 计算充电桩位置与当前聚类中心的距离
-        distances = np.linalg.norm(cluster_center - np.array(individual))
-        return distances
+def yearly_clustering(data, demand_by_year, n_clusters=5):
+    """
+    逐年按预测需求加权聚类，每年以上一年的聚类中心热启动
+    参数:
+        data: 含 '经度'、'纬度' 列的需求点表
+        demand_by_year: 年份 -> 各需求点的预测需求（按年份顺序处理）
+    返回:
+        年份 -> (各需求点所属聚类, 聚类中心)
+    """
+    results = {}
+    centers = None
+    for year, weights in demand_by_year.items():
+        clustered, centers = spatial_clustering(data.copy(), n_clusters, weights=weights, init_centers=centers)
+        results[year] = (clustered['cluster'].values, centers)
+    return results
+
+# 粒子群优化算法（PSO）: 随机种子与多起点运行次数
+PSO_SEED = 42
+PSO_STARTS = 8
 
-    # 对每个聚类分别进行优化
-    best_stations_per_cluster = []
-    for cluster_center in cluster_centers:
-        # 定义优化问题的边界
-        lb = [73, 18]  # 经度和纬度的下限
-        ub = [135, 53]  # 经度和纬度的上限
+def cluster_distance_objective(swarm, cluster_centers):
+    """整个粒子群 (聚类数, 粒子数, 维数) 中各充电桩到聚类中心的球面距离（公里）之和，一次计算"""
+    stations = swarm.reshape(swarm.shape[0], swarm.shape[1], -1, 2)
+    return haversine_km(stations, cluster_centers[:, None, None, :]).sum(axis=2)
 
-        # 运行 PSO
-        best_position, _ = pso(evaluate, lb, ub, args=(cluster_center,))
-        best_stations_per_cluster.append(best_position)
+def pso_optimization_per_cluster(cluster_centers, n_stations=1, seed=PSO_SEED, patience=None, n_starts=1):
+    """
+    所有聚类组成一个批量粒子群同时优化
+    参数:
+        cluster_centers: (聚类数, 2) 聚类中心
+        n_stations: 每个聚类的充电桩数，粒子维数为 2*n_stations（经度、纬度交替）
+        seed: 随机种子
+        patience: 连续多少次迭代无改进时提前停止
+        n_starts: 大于 1 时在进程池中多起点运行，每个聚类取所有运行中的最优位置并打印收敛统计
+    返回:
+        每个聚类的最优位置列表
+    """
+    cluster_centers = np.asarray(cluster_centers, dtype=float)
 
-    return best_stations_per_cluster
+    # 定义优化问题的边界
+    lb = [73, 18] * n_stations  # 经度和纬度的下限
+    ub = [135, 53] * n_stations  # 经度和纬度的上限
+
+    # 运行 PSO
+    if n_starts > 1:
+        result = multi_start_pso(cluster_distance_objective, lb, ub, n_problems=len(cluster_centers),
+                                 args=(cluster_centers,), n_starts=n_starts, seed=seed, patience=patience)
+        summary = result['summary']
+        print(f"PSO 多起点运行 {n_starts} 次（各聚类分别取最优）: 最优合计 {summary['最优目标值'].sum():.4f}，"
+              f"平均合计 {summary['平均目标值'].sum():.4f}，最差合计 {summary['最差目标值'].sum():.4f}，"
+              f"出现多个方案的聚类 {int((summary['不同方案数'] > 1).sum())} 个")
+        return list(result['positions'])
+    best_positions, _, _ = batched_pso(cluster_distance_objective, lb, ub, n_problems=len(cluster_centers),
+                                       args=(cluster_centers,), seed=seed, patience=patience)
+    return list(best_positions)
+
+# 需求加权选址（p-median / 最大覆盖）
+def demand_weighted_location(predictions_df, extra_candidates, p,
+                             objective=LOCATION_OBJECTIVE, solver=LOCATION_SOLVER, years=FORECAST_YEARS):
+    """
+    以各省份 years 年份的平均预测保有量为需求权重选出 p 个站点
+    参数:
+        predictions_df: 省份名称已补全的预测结果表
+        extra_candidates: 省会坐标之外的候选站点（如 PSO 结果），每行 [经度, 纬度, ...]
+    返回:
+        (选中站点经纬度 (p, 2), solve_location 的结果字典)
+    """
+    demand_coords, demand = demand_from_predictions(predictions_df, province_coordinates, years)
+    weights = demand.mean(axis=1)
+    candidates = np.vstack([demand_coords, np.asarray(extra_candidates, dtype=float).reshape(-1, 2)])
+    result = solve_location(candidates, demand_coords, weights, p, objective=objective, solver=solver)
+    return candidates[result['sites']], result
+
+# 多期选址: 逐年增量规划分期建设
+def staged_deployment(predictions_df, extra_candidates, years=FORECAST_YEARS, site_capacity=SITE_CAPACITY):
+    """
+    以各省份逐年预测保有量为需求，按省份容量上限（PROVINCE_CAPACITY）与单站容量逐年增量规划
+    候选站点为省会坐标、extra_candidates 以及需求点周边的经纬度网格
+    返回:
+        multi_period_plan 的结果字典（'schedule' 为 站点 × 年份 的建设计划）
+    """
+    demand_coords, demand = demand_from_predictions(predictions_df, province_coordinates, years)
+    regions = predictions_df.loc[predictions_df['省份'].isin(list(province_coordinates)), '省份'].values
+    region_caps = {adjust_province_name(name): cap for name, cap in PROVINCE_CAPACITY.items()}
+    candidates = np.vstack([
+        demand_coords,
+        np.asarray(extra_candidates, dtype=float).reshape(-1, 2),
+        candidate_grid(demand_coords, step_deg=CANDIDATE_GRID_STEP),
+    ])
+    return multi_period_plan(candidates, demand_coords, demand, years, site_capacity=site_capacity,
+                             regions=regions, region_caps=region_caps)
 
 # 绘制中国地图（每个聚类标记一个最优选址）
 def plot_china_map_with_optimal_stations(clustered_data, best_stations_per_cluster):
-    # 使用相对路径读取中国地图数据
+    # 使用相对路径读取中国地图数据（从几何缓存读取简化后的省界）
     china_map_path = os.path.join(current_dir, "china.json")
-    china_map = gpd.read_file(china_map_path)
+    china_map = load_geometry(china_map_path)
     
     # 合并聚类数据到地图数据
     china_map = china_map.merge(clustered_data, left_on='name', right_on='省份', how='left')
@@ -186,7 +288,7 @@ def plot_china_map_with_optimal_stations(clustered_data, best_stations_per_clust
 # 主程序
 if __name__ == "__main__":
     # 加载预测结果
-    predictions_df = load_predictions()
+    predictions_df = load_predictions(years=FORECAST_YEARS)
 
     # 打印 predictions_df['省份'] 的内容，检查省份名称
     print("原始省份名称：", predictions_df['省份'].unique())
@@ -200,11 +302,12 @@ if __name__ == "__main__":
     predictions_df['纬度'] = predictions_df['省份'].map(lambda x: province_coordinates[x][1])
 
     # 空间聚类
-    clustered_data, cluster_centers = spatial_clustering(predictions_df, n_clusters=5)
+    demand_weights = predictions_df[[str(y) for y in FORECAST_YEARS]].mean(axis=1).values
+    clustered_data, cluster_centers = spatial_clustering(predictions_df, n_clusters=5, weights=demand_weights)
     print("聚类中心点：", cluster_centers)
 
     # 使用 PSO 优化
-    best_stations_per_cluster = pso_optimization_per_cluster(cluster_centers, n_stations=1)
+    best_stations_per_cluster = pso_optimization_per_cluster(cluster_centers, n_stations=1, n_starts=PSO_STARTS)
     print("每个聚类的最优充电桩位置：", best_stations_per_cluster)
 
     # 保存结果
@@ -218,5 +321,20 @@ if __name__ == "__main__":
     optimized_stations_df.to_excel(output_path, index=False)
     print("优化结果已保存至:", output_path)
 
+    # 需求加权选址（以 2023-2030 年预测保有量为权重）
+    weighted_sites, location_result = demand_weighted_location(
+        predictions_df, best_stations_per_cluster, p=len(cluster_centers)
+    )
+    print(f"需求加权选址（{LOCATION_OBJECTIVE}）目标值: {location_result['objective']:.1f}")
+    weighted_path = os.path.join(output_folder, "需求加权选址结果.xlsx")
+    pd.DataFrame(weighted_sites, columns=['经度', '纬度']).to_excel(weighted_path, index=False)
+    print("需求加权选址结果已保存至:", weighted_path)
+
+    # 多期选址（2023-2030 年逐年增量规划）
+    plan = staged_deployment(predictions_df, best_stations_per_cluster)
+    schedule_path = os.path.join(output_folder, "充电桩分期建设计划.xlsx")
+    plan['schedule'].to_excel(schedule_path, index=False)
+    print("分期建设计划已保存至:", schedule_path)
+
     # 绘制中国地图（每个聚类标记一个最优选址）
     plot_china_map_with_optimal_stations(clustered_data, best_stations_per_cluster)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+批量粒子群优化（PSO）
+
+替代 pyswarm.pso 的逐粒子调用:
+    - 目标函数一次接收整个粒子群，形状 (问题数, 粒子数, 维数)，返回 (问题数, 粒子数) 的适应度
+    - 多个独立问题（如各聚类）组成一个批量粒子群同时迭代，每一步只调用一次目标函数
+    - 随机数由 seed 控制，结果可复现；各问题分别判断收敛（提前停止），已收敛的问题不再更新
+    - multi_start_pso 在进程池中以不同种子并行运行多次，各问题分别取所有运行中的最优解，
+      并按问题去除几乎相同的解，保留最优的若干方案
+"""
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 默认参数与 pyswarm.pso 一致
+PSO_SETTINGS = {
+    'swarmsize': 100,
+    'omega': 0.5,
+    'phip': 0.5,
+    'phig': 0.5,
+    'maxiter': 100,
+    'minstep': 1e-8,
+    'minfunc': 1e-8,
+}
+
+def batched_pso(objective: Callable[..., np.ndarray],
+                lb: Any,
+                ub: Any,
+                n_problems: int = 1,
+                args: tuple = (),
+                swarmsize: int = PSO_SETTINGS['swarmsize'],
+                omega: float = PSO_SETTINGS['omega'],
+                phip: float = PSO_SETTINGS['phip'],
+                phig: float = PSO_SETTINGS['phig'],
+                maxiter: int = PSO_SETTINGS['maxiter'],
+                minstep: float = PSO_SETTINGS['minstep'],
+                minfunc: float = PSO_SETTINGS['minfunc'],
+                patience: Optional[int] = None,
+                seed: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """
+    参数:
+        objective: objective(X, *args)，X 形状 (问题数, 粒子数, 维数)，返回 (问题数, 粒子数) 适应度（越小越好）
+        lb / ub: 边界，形状 (维数,) 或 (问题数, 维数)
+        n_problems: 同时优化的独立问题数
+        swarmsize: 每个问题的粒子数
+        omega / phip / phig: 惯性权重、个体与全局学习因子
+        maxiter: 最大迭代次数
+        minstep: 全局最优位置的移动量小于该值时停止
+        minfunc: 全局最优值的改进量小于该值时停止
+        patience: 连续多少次迭代全局最优未改进时停止（None 表示不启用）
+        seed: 随机种子
+    返回:
+        (各问题的最优位置 (问题数, 维数), 最优值 (问题数,), 信息字典 {'iterations': 各问题停止时的迭代次数, 'converged': 是否提前收敛})
+    """
+    rng = np.random.default_rng(seed)
+    lb = np.asarray(lb, dtype=float)
+    ub = np.asarray(ub, dtype=float)
+    dims = lb.shape[-1]
+    lb = np.broadcast_to(lb, (n_problems, dims))[:, None, :]
+    ub = np.broadcast_to(ub, (n_problems, dims))[:, None, :]
+    if np.any(ub < lb):
+        raise ValueError("上界必须不小于下界")
+    span = ub - lb
+    shape = (n_problems, swarmsize, dims)
+
+    # 初始化粒子位置与速度
+    x = lb + rng.random(shape) * span
+    v = -span + rng.random(shape) * 2 * span
+    fx = np.asarray(objective(x, *args), dtype=float)
+    p, fp = x.copy(), fx.copy()
+    best = np.argmin(fp, axis=1)
+    rows = np.arange(n_problems)
+    g, fg = p[rows, best].copy(), fp[rows, best].copy()
+
+    active = np.ones(n_problems, dtype=bool)
+    converged = np.zeros(n_problems, dtype=bool)
+    iterations = np.zeros(n_problems, dtype=int)
+    stale = np.zeros(n_problems, dtype=int)
+    for it in range(1, maxiter + 1):
+        rp = rng.random(shape)
+        rg = rng.random(shape)
+        v_new = omega * v + phip * rp * (p - x) + phig * rg * (g[:, None, :] - x)
+        x_new = np.clip(x + v_new, lb, ub)
+        # 已停止的问题保持不变
+        mask = active[:, None, None]
+        v = np.where(mask, v_new, v)
+        x = np.where(mask, x_new, x)
+        fx = np.asarray(objective(x, *args), dtype=float)
+
+        improved = (fx < fp) & active[:, None]
+        p[improved] = x[improved]
+        fp[improved] = fx[improved]
+
+        best = np.argmin(fp, axis=1)
+        candidate, f_candidate = p[rows, best], fp[rows, best]
+        better = (f_candidate < fg) & active
+        step = np.linalg.norm(candidate - g, axis=1)
+        gain = fg - f_candidate
+        g[better], fg[better] = candidate[better], f_candidate[better]
+        iterations[active] = it
+
+        stale = np.where(better, 0, stale + 1)
+        done = better & ((step <= minstep) | (gain <= minfunc))
+        if patience is not None:
+            done |= active & (stale >= patience)
+        converged |= done
+        active &= ~done
+        if not active.any():
+            break
+
+    return g, fg, {'iterations': iterations, 'converged': converged}
+
+def _pso_run(objective: Callable[..., np.ndarray],
+             lb: Any,
+             ub: Any,
+             n_problems: int,
+             args: tuple,
+             seed: int,
+             settings: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """单次运行（可在子进程中执行）"""
+    return batched_pso(objective, lb, ub, n_problems=n_problems, args=args, seed=seed, **settings)
+
+def multi_start_pso(objective: Callable[..., np.ndarray],
+                    lb: Any,
+                    ub: Any,
+                    n_problems: int = 1,
+                    args: tuple = (),
+                    n_starts: int = 8,
+                    seed: Optional[int] = None,
+                    max_workers: Optional[int] = None,
+                    top_k: int = 3,
+                    dedup_tol: float = 1e-3,
+                    **settings) -> Dict[str, Any]:
+    """
+    多起点并行运行 batched_pso
+    参数:
+        objective: 同 batched_pso，需可被 pickle（模块级函数）才能在进程池中运行
+        n_starts: 运行次数，各次的种子由 seed 派生，整体结果可复现
+        max_workers: 进程数，默认 min(运行次数, CPU 核数)；为 1 时顺序执行
+        top_k: 每个问题保留的最优方案数
+        dedup_tol: 两个方案所有坐标之差的最大值小于该值时视为同一方案
+        settings: 传给 batched_pso 的其他参数
+    返回:
+        {'positions': (问题数, 维数) 各问题在所有运行中的最优位置,
+         'values': (问题数,) 对应的最优目标值,
+         'plans': 每个问题一个列表，按目标值升序的去重方案，每项为 {'position', 'value', 'seed', 'count'},
+         'runs': 逐次运行的统计表（种子、总目标值、平均迭代次数、收敛比例、取得最优的问题数）,
+         'summary': 逐问题的收敛统计表（最优/平均/标准差/最差目标值、不同方案数）}
+    说明:
+        各问题相互独立，最优解按问题分别从所有运行中选取，而不是整体选总目标值最小的一次运行
+    """
+    seeds = [int(s) for s in np.random.SeedSequence(seed).generate_state(n_starts)]
+    max_workers = max_workers or min(n_starts, os.cpu_count() or 1)
+    run_args = [(objective, lb, ub, n_problems, args, s, settings) for s in seeds]
+    if max_workers <= 1:
+        outcomes = [_pso_run(*a) for a in run_args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = list(executor.map(_pso_run, *zip(*run_args)))
+
+    # (运行数, 问题数, 维数) 与 (运行数, 问题数)
+    positions = np.stack([g for g, _, _ in outcomes])
+    values = np.stack([fg for _, fg, _ in outcomes])
+    order = np.argsort(values, axis=0, kind='stable')
+    best_run = order[0]
+    problems = np.arange(n_problems)
+
+    plans: List[List[Dict[str, Any]]] = []
+    for i in problems:
+        problem_plans: List[Dict[str, Any]] = []
+        # 从该问题最优的运行开始，与已有方案几乎相同的归入该方案
+        for r in order[:, i]:
+            match = next((plan for plan in problem_plans
+                          if np.max(np.abs(plan['position'] - positions[r, i])) < dedup_tol), None)
+            if match is None:
+                problem_plans.append({'position': positions[r, i], 'value': float(values[r, i]),
+                                      'seed': seeds[r], 'count': 1})
+            else:
+                match['count'] += 1
+        plans.append(problem_plans)
+
+    runs = pd.DataFrame({
+        '种子': seeds,
+        '总目标值': values.sum(axis=1),
+        '平均迭代次数': [info['iterations'].mean() for _, _, info in outcomes],
+        '收敛比例': [info['converged'].mean() for _, _, info in outcomes],
+        '最优问题数': np.bincount(best_run, minlength=n_starts),
+    })
+    summary = pd.DataFrame({
+        '问题': problems,
+        '最优目标值': values.min(axis=0),
+        '平均目标值': values.mean(axis=0),
+        '目标值标准差': values.std(axis=0),
+        '最差目标值': values.max(axis=0),
+        '不同方案数': [len(problem_plans) for problem_plans in plans],
+    })
+    return {'positions': positions[best_run, problems], 'values': values[best_run, problems],
+            'plans': [problem_plans[:top_k] for problem_plans in plans], 'runs': runs, 'summary': summary}
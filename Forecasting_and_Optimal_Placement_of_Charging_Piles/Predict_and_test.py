@@ -1,15 +1,24 @@
+import os
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from prophet import Prophet
-from sklearn.ensemble import RandomForestRegressor
-from statsmodels.tsa.api import VAR
-from sklearn.metrics import mean_absolute_percentage_error
+import logging
 import warnings
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+# prophet / statsmodels / sklearn / matplotlib 在首次使用时由注册表加载，导入本模块不拟合任何模型
+from Model_registry import get_backend, register_backend
+from Chart_utils import finish_figure
 
 warnings.filterwarnings("ignore")
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
+
+def _load_pyplot():
+    import matplotlib.pyplot as plt
+    plt.rcParams['font.sans-serif'] = ['SimHei']
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
+
+register_backend('pyplot', _load_pyplot)
 
 # ==================== 数据准备 ====================
 data = {
@@ -26,7 +35,7 @@ df = df.asfreq('YS')
 # ==================== 模型定义 ====================
 def prophet_forecast(df, col, periods=6):
     df_p = df[[col]].reset_index().rename(columns={'Year':'ds', col:'y'})
-    model = Prophet(seasonality_mode='multiplicative',
+    model = get_backend('prophet')(seasonality_mode='multiplicative',
                    changepoint_prior_scale=0.5,
                    yearly_seasonality=False)
     model.fit(df_p)
@@ -34,9 +43,42 @@ def prophet_forecast(df, col, periods=6):
     forecast = model.predict(future)
     return forecast.set_index('ds')[['yhat']].rename(columns={'yhat': f'{col}_Prophet'})
 
+def _quiet_stan():
+    """关闭 cmdstanpy / prophet 的逐次拟合日志（进程池初始化时调用）"""
+    for name in ('cmdstanpy', 'prophet'):
+        logger = logging.getLogger(name)
+        # cmdstanpy 在没有处理器时会自行挂上 INFO 级别的处理器，先占位
+        if not logger.handlers:
+            logger.addHandler(logging.NullHandler())
+        logger.setLevel(logging.WARNING)
+
+def prophet_forecast_many(df, cols, periods=6, max_workers=None):
+    """
+    在进程池中并行拟合多个指标的 Prophet 模型
+    参数:
+        cols: 指标列表，每个指标一次独立的 Stan 拟合
+        max_workers: 进程数，默认 min(指标数, CPU 核数)；为 1 时顺序执行
+    返回:
+        按 cols 顺序拼接的 {指标}_Prophet 预测表
+    说明:
+        只应在显式调用中（如 get_forecasts 或 __main__ 下）使用进程池；若在子进程中被调用
+        （spawn 平台上子进程导入模块时），改为顺序执行，不再嵌套创建进程池
+    """
+    cols = list(cols)
+    max_workers = max_workers or min(len(cols), os.cpu_count() or 1)
+    if multiprocessing.parent_process() is not None:
+        max_workers = 1
+    if max_workers <= 1:
+        _quiet_stan()
+        preds = [prophet_forecast(df, col, periods) for col in cols]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_quiet_stan) as executor:
+            preds = list(executor.map(prophet_forecast, [df] * len(cols), cols, [periods] * len(cols)))
+    return pd.concat(preds, axis=1)
+
 def var_forecast(df):
     df_diff = df.diff().dropna()
-    model = VAR(df_diff)
+    model = get_backend('var')(df_diff)
     result = model.fit(maxlags=3)
     forecast = result.forecast(df_diff.values[-3:], steps=6)
     
@@ -60,41 +102,75 @@ def create_features(df):
     df_feat['Sales_ma3'] = df_feat['Sales'].rolling(3).mean()
     return df_feat.dropna()
 
+RF_TARGETS = ['Sales', 'Patents', 'Chargers']
+
+def direct_training_set(df_feat, targets=RF_TARGETS, horizons=6):
+    """
+    直接多步训练集: 将各预测步长的样本堆叠，步长作为一个特征
+    目标为 h 年后相对当年的对数增长 log(y[t+h] / y[t])，使树模型可以外推到历史最大值以上
+    """
+    X_parts, y_parts = [], []
+    levels = np.log(df_feat[targets].values.astype(float))
+    for h in range(1, horizons + 1):
+        if h >= len(df_feat):
+            break
+        X_h = df_feat.iloc[:-h].copy()
+        X_h['horizon'] = h
+        X_parts.append(X_h)
+        y_parts.append(levels[h:] - levels[:-h])
+    return pd.concat(X_parts), np.vstack(y_parts)
+
+def rf_direct_forecast(df, periods=6, n_estimators=200, max_depth=5, n_jobs=-1, random_state=42):
+    """
+    直接多步随机森林预测（单个多输出模型，一次向量化调用给出全部年份）
+    返回:
+        future_rf: 各指标的点预测（列名 {指标}_RF）
+        tree_preds: 每棵树的预测值，形状 (树数, 年数, 指标数)，可直接取分位数作为预测区间
+    """
+    df_feat = create_features(df)
+    X, y = direct_training_set(df_feat, RF_TARGETS, periods)
+    rf = get_backend('random_forest')(n_estimators=n_estimators, max_depth=max_depth,
+                               random_state=random_state, n_jobs=n_jobs)
+    rf.fit(X.values, y)
+    
+    # 以最后一年为起点，各步长各一行
+    X_future = np.repeat(df_feat.iloc[[-1]].values, periods, axis=0)
+    X_future = np.column_stack([X_future, np.arange(1, periods + 1)])
+    last_values = df_feat[RF_TARGETS].values[-1].astype(float)
+    tree_growth = np.stack([tree.predict(X_future) for tree in rf.estimators_])
+    tree_preds = last_values * np.exp(tree_growth.reshape(len(rf.estimators_), periods, -1))
+    
+    forecast_index = pd.date_range(start=df.index[-1] + pd.DateOffset(years=1), periods=periods, freq='YS')
+    future_rf = pd.DataFrame(last_values * np.exp(rf.predict(X_future).reshape(periods, -1)),
+                             index=forecast_index, columns=[f'{col}_RF' for col in RF_TARGETS])
+    return future_rf, tree_preds
+
+def rf_prediction_interval(tree_preds, quantiles=(0.1, 0.9)):
+    """由逐树预测取分位数，返回形状 (分位数个数, 年数, 指标数)"""
+    return np.quantile(tree_preds, quantiles, axis=0)
+
 # ==================== 预测执行 ====================
-prophet_preds = []
-for col in ['Sales', 'Patents', 'Chargers']:
-    prophet_preds.append(prophet_forecast(df, col))
-prophet_result = pd.concat(prophet_preds, axis=1)
-
-var_forecast_df = var_forecast(df)
-
-rf_df = create_features(df)
-X = rf_df.drop(['Sales', 'Patents', 'Chargers'], axis=1)
-y = rf_df[['Sales', 'Patents', 'Chargers']]
-
-rf = RandomForestRegressor(n_estimators=200, max_depth=5, random_state=42)
-rf.fit(X, y)
-
-forecast_index = pd.date_range(start='2025-01-01', periods=6, freq='YS')
-future_rf = pd.DataFrame(index=forecast_index, columns=['Sales_RF', 'Patents_RF', 'Chargers_RF'])
-last_row = X.iloc[-1].copy()
-
-for i in range(6):
-    pred = rf.predict([last_row])[0]
-    future_rf.iloc[i] = pred
-    for j, var in enumerate(['Sales', 'Patents', 'Chargers']):
-        last_row[f'{var}_lag2'] = last_row[f'{var}_lag1']
-        last_row[f'{var}_lag1'] = pred[j]
-    last_row['time_index'] += 1
-
-result_df = pd.concat([
-    prophet_result[['Sales_Prophet', 'Patents_Prophet', 'Chargers_Prophet']],
-    var_forecast_df,
-    future_rf
-], axis=1)
+_RESULT_DF = None
+
+def get_forecasts(refresh=False):
+    """三个模型的2025-2030预测汇总表，首次调用时拟合，之后复用"""
+    global _RESULT_DF
+    if _RESULT_DF is None or refresh:
+        prophet_result = prophet_forecast_many(df, ['Sales', 'Patents', 'Chargers'])
+        var_forecast_df = var_forecast(df)
+        future_rf, _ = rf_direct_forecast(df)
+        _RESULT_DF = pd.concat([
+            prophet_result[['Sales_Prophet', 'Patents_Prophet', 'Chargers_Prophet']],
+            var_forecast_df,
+            future_rf
+        ], axis=1)
+    return _RESULT_DF
 
 # ==================== 绘图函数 ====================
-def plot_forecast(var_name):
+def plot_forecast(var_name, save_path=None):
+    """单个指标的预测对比图；给出 save_path 时保存，Agg 后端下不弹窗"""
+    plt = get_backend('pyplot')
+    result_df = get_forecasts()
     plt.figure(figsize=(10, 5))
     plt.plot(df.index, df[var_name], label='历史数据', marker='o', color='black', linewidth=2)
     
@@ -120,74 +196,122 @@ def plot_forecast(var_name):
     plt.grid(True, linestyle='--', alpha=0.6)
     plt.legend()
     plt.tight_layout()
-    plt.show()
+    finish_figure(plt.gcf(), save_path)
 
 # ==================== 模型检测 ====================
-def model_health_check():
+HEALTH_MODELS = ['Prophet', 'VAR', 'RF']
+HEALTH_COLUMNS = ['Sales', 'Patents', 'Chargers']
+
+# (模型, 指标, 训练截止, 验证截止) -> (是否通过, 说明, 预测值)
+_EVAL_CACHE = {}
+_EVAL_LOCK = threading.Lock()
+
+def _holdout_split(train_end, test_end, data=None):
+    data = df if data is None else data
+    train_data = data.loc[:train_end]
+    test_data = data.loc[str(int(train_end) + 1):test_end]
+    return train_data, test_data
+
+def evaluate_model(model_type, col='Sales', train_end='2021', test_end='2024', data=None):
+    """
+    在留出期上评估单个模型，结果按 (模型, 指标, 训练/验证窗口) 缓存，重复调用不再重新拟合
+    data: 指定时用该数据表代替模块内的 df（如进程池中由调用方传入），此时不读写缓存
+    """
+    key = (model_type, col, train_end, test_end)
+    with _EVAL_LOCK:
+        if data is None and key in _EVAL_CACHE:
+            return _EVAL_CACHE[key]
+    
+    train_data, test_data = _holdout_split(train_end, test_end, data)
+    steps = len(test_data)
+    try:
+        if model_type == 'Prophet':
+            m = get_backend('prophet')(seasonality_mode='multiplicative')
+            m.fit(train_data[[col]].reset_index().rename(columns={'Year':'ds', col:'y'}))
+            future = m.make_future_dataframe(periods=steps, freq='YS')
+            pred = m.predict(future).set_index('ds')['yhat'].iloc[-steps:]
+        
+        elif model_type == 'VAR':
+            df_diff = train_data.diff().dropna()
+            m = get_backend('var')(df_diff)
+            res = m.fit(maxlags=3)
+            pred_diff = res.forecast(df_diff.values[-3:], steps=steps)[:, df_diff.columns.get_loc(col)]
+            pred = train_data[col].iloc[-1] + np.cumsum(pred_diff)
+            pred = pd.Series(pred, index=test_data.index)
+        
+        elif model_type == 'RF':
+            X_train = train_data.index.astype(int).values.reshape(-1,1)
+            y_train = train_data[col].values
+            m = get_backend('random_forest')(n_estimators=200, max_depth=5, random_state=42)
+            m.fit(X_train, y_train)
+            pred = m.predict(test_data.index.astype(int).values.reshape(-1,1))
+            pred = pd.Series(pred, index=test_data.index)
+        
+        else:
+            raise ValueError(f"未知模型: {model_type}")
+        
+        mape = get_backend('mape')(test_data[col], pred)
+        result = (mape < 20, f"MAPE={mape:.1f}%", pred)
+    
+    except Exception as e:
+        result = (False, f"运行失败: {str(e)}", None)
+    
+    if data is None:
+        with _EVAL_LOCK:
+            _EVAL_CACHE[key] = result
+    return result
+
+def evaluation_harness(models=HEALTH_MODELS, cols=HEALTH_COLUMNS,
+                       train_end='2021', test_end='2024', max_workers=None):
+    """
+    并发评估所有 (模型, 指标) 组合，返回整洁的指标表
+    列: 模型, 指标, 训练截止, 验证截止, 通过, 说明
+    各组合的预测值可通过 evaluate_model 从缓存中直接取得
+    """
+    tasks = [(model, col) for col in cols for model in models]
+    # Prophet 在 cmdstan 子进程中拟合，sklearn/statsmodels 计算时释放 GIL，线程即可并发
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        outcomes = list(executor.map(
+            lambda task: evaluate_model(task[0], task[1], train_end, test_end), tasks
+        ))
+    return pd.DataFrame([
+        {'模型': model, '指标': col, '训练截止': train_end, '验证截止': test_end,
+         '通过': status, '说明': detail}
+        for (model, col), (status, detail, _) in zip(tasks, outcomes)
+    ])
+
+def model_health_check(cols=HEALTH_COLUMNS, max_workers=None, save_path=None):
     print("\n" + "="*50)
     print("模型健康检测报告（基于MAPE指标）")
     print("="*50)
     
-    test_data = df.loc['2022':'2024']
-    train_data = df.loc[:'2021']
-    
-    # 存储各模型预测结果用于绘图
-    pred_results = {}
-    
-    def evaluate_model(model_type, col='Sales'):
-        try:
-            if model_type == 'Prophet':
-                m = Prophet(seasonality_mode='multiplicative')
-                m.fit(train_data[[col]].reset_index().rename(columns={'Year':'ds', col:'y'}))
-                future = m.make_future_dataframe(periods=3, freq='YS')
-                pred = m.predict(future).set_index('ds')['yhat'].iloc[-3:]
-            
-            elif model_type == 'VAR':
-                df_diff = train_data.diff().dropna()
-                m = VAR(df_diff)
-                res = m.fit(maxlags=3)
-                pred_diff = res.forecast(df_diff.values[-3:], steps=3)[:, df_diff.columns.get_loc(col)]
-                pred = train_data[col].iloc[-1] + np.cumsum(pred_diff)
-                pred = pd.Series(pred, index=test_data.index)
-            
-            elif model_type == 'RF':
-                X_train = train_data.index.astype(int).values.reshape(-1,1)
-                y_train = train_data[col].values
-                m = RandomForestRegressor(n_estimators=200, max_depth=5, random_state=42)
-                m.fit(X_train, y_train)
-                pred = m.predict(test_data.index.astype(int).values.reshape(-1,1))
-                pred = pd.Series(pred, index=test_data.index)
-            
-            mape = mean_absolute_percentage_error(test_data[col], pred)
-            return mape < 20, f"MAPE={mape:.1f}%", pred
-        
-        except Exception as e:
-            return False, f"运行失败: {str(e)}", None
+    train_end, test_end = '2021', '2024'
+    _, test_data = _holdout_split(train_end, test_end)
+    metrics = evaluation_harness(HEALTH_MODELS, cols, train_end, test_end, max_workers)
+    plt = get_backend('pyplot')
     
     # 检测三个模型
-    models = ['Prophet', 'VAR', 'RF']
-    colors = ['blue', 'green', 'red']
-    plt.figure(figsize=(10,4))
-    plt.plot(test_data['Sales'], label='实际值', marker='o', color='black')
-    
-    for model, color in zip(models, colors):
-        status, detail, pred = evaluate_model(model)
-        print(f"{model}模型: {'✅通过' if status else '❌失败'} | {detail}")
-        if status and pred is not None:
-            pred_results[model] = pred
-            plt.plot(pred, label=f'{model}预测', linestyle='--', color=color)
+    colors = dict(zip(HEALTH_MODELS, ['blue', 'green', 'red']))
+    fig, axes = plt.subplots(len(cols), 1, figsize=(10, 4 * len(cols)), squeeze=False)
+    for ax, col in zip(axes[:, 0], cols):
+        ax.plot(test_data[col], label='实际值', marker='o', color='black')
+        for row in metrics[metrics['指标'] == col].itertuples():
+            _, _, pred = evaluate_model(row.模型, col, train_end, test_end)
+            print(f"{row.模型}模型[{col}]: {'✅通过' if row.通过 else '❌失败'} | {row.说明}")
+            if row.通过 and pred is not None:
+                ax.plot(pred, label=f'{row.模型}预测', linestyle='--', color=colors[row.模型])
+        ax.set_title(f'{col} 验证期(2022-2024)预测对比')
+        ax.legend()
+        ax.grid(True, linestyle='--', alpha=0.3)
     
-    plt.title('验证期(2022-2024)预测对比')
-    plt.legend()
-    plt.grid(True, linestyle='--', alpha=0.3)
     plt.tight_layout()
-    plt.show()
+    finish_figure(fig, save_path)
     
     print("\n检测结论（MAPE<20%为通过）:")
-    for model in models:
-        status, detail, _ = evaluate_model(model)
-        print(f"- {model}: {'正常' if status else '异常'} ({detail})")
+    for row in metrics.itertuples():
+        print(f"- {row.模型}[{row.指标}]: {'正常' if row.通过 else '异常'} ({row.说明})")
     print("="*50 + "\n")
+    return metrics
 
 # ==================== 主程序 ====================
 if __name__ == '__main__':
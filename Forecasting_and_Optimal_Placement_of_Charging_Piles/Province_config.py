@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+省份配置参数
+
+预测脚本（ARIMA_randon_forest_predict、Global_panel_model）与选址脚本
+（Optimization_model_for_the_Location_of_charging_piles）共用的省份级常量，
+单独成模块，选址脚本读取容量上限时不必导入整个预测模块。
+"""
+
+# 政策系数
+PROVINCE_POLICY = {
+    '西藏': 1.5, '青海': 1.2, '宁夏': 1.1,
+    # 其他省份默认为1.0
+}
+
+# 容量上限（台）
+PROVINCE_CAPACITY = {
+    '北京': 500000, '上海': 600000, '广东': 1000000,
+    '西藏': 100000, '青海': 150000, '宁夏': 200000,
+    # 其他省份默认容量
+}
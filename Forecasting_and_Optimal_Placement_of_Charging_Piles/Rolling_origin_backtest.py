@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+滚动起点回测
+
+对省级混合预测（ARIMA_randon_forest_predict.hybrid_forecast 流程）和全国模型
+（Predict_and_test 中的 Prophet / VAR / RF）做滚动起点交叉验证:
+    - 起点与预测步长可配置，各折在进程池中并行执行
+    - 省级回测中同一省份的相邻起点沿用上一起点选定的ARIMA阶数（增量更新），不重复搜索
+    - 输出按 序列 / 模型 / 步长 汇总的 MAPE 与 sMAPE；模型拟合失败的折以 NaN 误差保留并计入失败数
+"""
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import ARIMA_randon_forest_predict as provincial
+
+def rolling_origins(n_obs: int, min_train: int, step: int = 1) -> List[int]:
+    """滚动起点: 训练集长度从 min_train 开始，每次增加 step，至少保留一个验证点"""
+    return list(range(min_train, n_obs, step))
+
+def _error_rows(series_name: str, model: str, origin_year: int, actual: np.ndarray, forecast: np.ndarray) -> List[Dict[str, Any]]:
+    """逐步长计算 APE 与 sAPE（百分比）"""
+    actual = np.asarray(actual, dtype=float)
+    forecast = np.asarray(forecast, dtype=float)[:len(actual)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ape = np.abs(actual - forecast) / np.abs(actual) * 100
+        sape = 2 * np.abs(actual - forecast) / (np.abs(actual) + np.abs(forecast)) * 100
+    return [
+        {'序列': series_name, '模型': model, '起点': origin_year, '步长': h + 1,
+         '实际值': actual[h], '预测值': forecast[h], 'APE': ape[h], 'sAPE': sape[h]}
+        for h in range(len(actual))
+    ]
+
+# ==================== 省级回测 ====================
+def _backtest_province(province: str,
+                       values: np.ndarray,
+                       years: List[int],
+                       origins: List[int],
+                       horizon: int,
+                       cache_dir: Optional[str]) -> List[Dict[str, Any]]:
+    """单个省份的全部起点（按时间顺序执行，后一起点以前一起点的模型记录热启动）"""
+    rows = []
+    state = None
+    for origin in origins:
+        steps = min(horizon, len(years) - origin)
+        try:
+            series = provincial.preprocess_series(values[:origin], years[:origin], province)
+            forecast, record, _ = provincial.forecast_with_record(
+                series, province, steps=steps, cache_dir=cache_dir, warm_state=state
+            )
+            floor, cap, min_growth = provincial.postprocess_bounds(series, province)
+            forecast = provincial.postprocess_forecasts(forecast, floor, cap, min_growth)[0]
+            state = record if record['tier'] == 'arima' else state
+            rows += _error_rows(province, record['tier'], years[origin - 1],
+                                values[origin:origin + steps], forecast)
+        except Exception as e:
+            print(f"{province} 起点{years[origin - 1]} 回测失败: {str(e)}")
+    return rows
+
+def backtest_provincial(panel: pd.DataFrame,
+                        provinces: Optional[List[str]] = None,
+                        min_train: int = 4,
+                        horizon: int = 3,
+                        step: int = 1,
+                        n_workers: int = 1,
+                        cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    省级混合预测的滚动起点回测
+    参数:
+        panel: build_panel 返回的 省份 × 年份 宽表
+        provinces: 参与回测的省份，默认全部
+        min_train: 首个起点的训练年数
+        horizon: 最大预测步长
+        step: 相邻起点的间隔年数
+        n_workers: 进程数（按省份分配，同一省份的起点在同一进程内顺序执行以复用阶数）
+        cache_dir: 模型缓存目录，默认不使用缓存
+    返回:
+        逐 (省份, 起点, 步长) 的误差明细表
+    """
+    provinces = provinces or list(panel.index)
+    years = [int(y) for y in panel.columns]
+    origins = rolling_origins(len(years), min_train, step)
+    values = panel.reindex(provinces).to_numpy(dtype=float)
+    tasks = [(p, row, years, origins, horizon, cache_dir) for p, row in zip(provinces, values)]
+
+    if n_workers <= 1:
+        outputs = [_backtest_province(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            outputs = list(executor.map(_backtest_province, *zip(*tasks)))
+    return pd.DataFrame([row for rows in outputs for row in rows])
+
+# ==================== 全国模型回测 ====================
+def _backtest_national_fold(model: str,
+                            col: str,
+                            train_end: str,
+                            test_end: str,
+                            data: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    全国模型的单折回测（复用 Predict_and_test.evaluate_model 的拟合）
+    参数:
+        data: 全国数据表，由调用方传入，子进程不再从 Predict_and_test 读取
+    返回:
+        逐步长误差行；模型拟合失败时预测值与误差为 NaN，失败仍计入样本数并打印原因
+    """
+    import Predict_and_test as national
+    _, message, pred = national.evaluate_model(model, col, train_end, test_end, data=data)
+    actual = data.loc[str(int(train_end) + 1):test_end, col].values
+    if pred is None:
+        print(f"{model}[{col}] 起点{train_end} 回测: {message}")
+        pred = np.full(len(actual), np.nan)
+    return _error_rows(col, model, int(train_end), actual, np.asarray(pred))
+
+def backtest_national(models: Optional[List[str]] = None,
+                      cols: Optional[List[str]] = None,
+                      min_train: int = 5,
+                      horizon: int = 3,
+                      step: int = 1,
+                      n_workers: int = 1) -> pd.DataFrame:
+    """
+    全国模型（Prophet / VAR / RF）的滚动起点回测
+    参数与返回同 backtest_provincial，'序列' 列为指标名
+    """
+    import Predict_and_test as national
+    models = models or national.HEALTH_MODELS
+    cols = cols or national.HEALTH_COLUMNS
+    data = national.df
+    years = list(data.index.year)
+    folds = [
+        (model, col, str(years[origin - 1]), str(years[min(origin + horizon, len(years)) - 1]), data)
+        for origin in rolling_origins(len(years), min_train, step)
+        for col in cols
+        for model in models
+    ]
+
+    if n_workers <= 1:
+        outputs = [_backtest_national_fold(*fold) for fold in folds]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            outputs = list(executor.map(_backtest_national_fold, *zip(*folds)))
+    return pd.DataFrame([row for rows in outputs for row in rows])
+
+# ==================== 汇总 ====================
+def backtest_report(errors: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """按 序列 / 模型 / 步长 汇总 MAPE 与 sMAPE"""
+    def summarize(by):
+        return errors.groupby(by).agg(
+            MAPE=('APE', 'mean'), sMAPE=('sAPE', 'mean'), 样本数=('APE', 'size'), 失败数=('APE', lambda x: x.isna().sum())
+        ).reset_index()
+    return {
+        '按序列': summarize(['序列']),
+        '按模型': summarize(['模型']),
+        '按步长': summarize(['步长']),
+        '按模型与步长': summarize(['模型', '步长']),
+    }
+
+if __name__ == "__main__":
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    output_folder = os.path.join(current_dir, "回测结果")
+    os.makedirs(output_folder, exist_ok=True)
+
+    workers = os.cpu_count() or 1
+    for name, errors in [
+        ('省级', backtest_provincial(provincial.builtin_panel(), n_workers=workers)),
+        ('全国', backtest_national(n_workers=workers)),
+    ]:
+        output_path = os.path.join(output_folder, f"{name}回测结果.xlsx")
+        with pd.ExcelWriter(output_path) as writer:
+            errors.to_excel(writer, sheet_name='明细', index=False)
+            for sheet, table in backtest_report(errors).items():
+                table.to_excel(writer, sheet_name=sheet, index=False)
+                if sheet == '按模型与步长':
+                    print(f"\n{name}回测（{sheet}）:\n{table.round(2)}")
+        print(f"{name}回测结果已保存至: {output_path}")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+站点空间索引
+
+以 haversine 度量的 BallTree 为候选站点建立索引，替代在经纬度上直接计算欧氏距离:
+    - 批量 k 近邻站点、服务半径内站点（覆盖）与被服务需求量查询
+    - PlanEvaluator 预先为每个需求点查询一次最近的 k 个候选，之后评估任意选址方案只需
+      一次布尔索引与 argmax（10 万需求点为毫秒级），不必重建距离矩阵
+距离单位为公里，坐标为 [经度, 纬度]（度）。
+"""
+import numpy as np
+from scipy import sparse
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from Model_registry import get_backend
+
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 40
+
+def haversine_km(a: Any, b: Any) -> np.ndarray:
+    """球面距离（公里），a、b 最后一维为 [经度, 纬度]，其余维度按广播规则对齐"""
+    a = np.radians(np.asarray(a, dtype=float))
+    b = np.radians(np.asarray(b, dtype=float))
+    dlon = a[..., 0] - b[..., 0]
+    dlat = a[..., 1] - b[..., 1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(a[..., 1]) * np.cos(b[..., 1]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def _to_radians(points: np.ndarray) -> np.ndarray:
+    """[经度, 纬度]（度） -> BallTree haversine 度量要求的 [纬度, 经度]（弧度）"""
+    return np.radians(np.asarray(points, dtype=float).reshape(-1, 2)[:, ::-1])
+
+class SiteIndex:
+    """候选站点的 haversine BallTree 索引"""
+    def __init__(self, sites: np.ndarray, leaf_size: int = LEAF_SIZE):
+        self.sites = np.asarray(sites, dtype=float).reshape(-1, 2)
+        self.tree = get_backend('ball_tree')(_to_radians(self.sites), metric='haversine', leaf_size=leaf_size)
+
+    def __len__(self) -> int:
+        return len(self.sites)
+
+    def nearest(self, points: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """批量 k 近邻，返回 (距离 (点数, k) 公里, 站点下标 (点数, k))，按距离升序"""
+        dist, idx = self.tree.query(_to_radians(points), k=min(k, len(self)))
+        return dist * EARTH_RADIUS_KM, idx
+
+    def knn_matrix(self, points: np.ndarray, k: int) -> sparse.coo_matrix:
+        """稀疏 站点 × 点 距离矩阵，每个点保留最近的 k 个站点（距离为 0 的元素同样保留）"""
+        dist, idx = self.nearest(points, k)
+        cols = np.repeat(np.arange(len(dist)), dist.shape[1])
+        return sparse.coo_matrix((dist.ravel(), (idx.ravel(), cols)), shape=(len(self), len(dist)))
+
+    def within(self, points: np.ndarray, radius_km: float) -> sparse.coo_matrix:
+        """稀疏 站点 × 点 距离矩阵，只保留服务半径内的站点"""
+        idx, dist = self.tree.query_radius(_to_radians(points), r=radius_km / EARTH_RADIUS_KM, return_distance=True)
+        counts = np.array([len(i) for i in idx])
+        rows = np.concatenate(idx) if len(idx) else np.array([], dtype=int)
+        data = np.concatenate(dist) * EARTH_RADIUS_KM if len(dist) else np.array([])
+        cols = np.repeat(np.arange(len(idx)), counts)
+        return sparse.coo_matrix((data, (rows.astype(int), cols)), shape=(len(self), len(idx)))
+
+    def served_demand(self, points: np.ndarray, weights: np.ndarray, radius_km: float) -> float:
+        """服务半径内至少有一个站点的需求量之和"""
+        counts = self.tree.query_radius(_to_radians(points), r=radius_km / EARTH_RADIUS_KM, count_only=True)
+        return float(np.asarray(weights, dtype=float)[counts > 0].sum())
+
+class PlanEvaluator:
+    """
+    选址方案评估: 需求点的 k 近邻候选只查询一次，之后每个方案在已排序的近邻中取第一个被选中的候选；
+    k 个近邻都未被选中的需求点才对方案中的站点单独建索引查询
+    """
+    def __init__(self, index: SiteIndex, demand: np.ndarray, weights: np.ndarray, k: int = 20):
+        self.index = index
+        self.demand = np.asarray(demand, dtype=float).reshape(-1, 2)
+        self.weights = np.asarray(weights, dtype=float)
+        self.dist, self.idx = index.nearest(self.demand, k)
+
+    def evaluate(self, sites: Sequence[int], radius_km: Optional[float] = None) -> Dict[str, Any]:
+        """
+        参数:
+            sites: 选中的候选下标
+            radius_km: 给出时同时统计服务半径内的需求量
+        返回:
+            {'assignment': 各需求点最近站点下标, 'distance': 到最近站点距离（公里）,
+             'weighted_distance': 需求加权总距离, 'served_demand': 半径内需求量（未给半径时为 None）}
+        """
+        sites = np.asarray(sites, dtype=int)
+        is_open = np.zeros(len(self.index), dtype=bool)
+        is_open[sites] = True
+        hit = is_open[self.idx]
+        first = hit.argmax(axis=1)
+        found = hit[np.arange(len(hit)), first]
+        rows = np.arange(len(hit))
+        assignment = np.where(found, self.idx[rows, first], -1)
+        distance = np.where(found, self.dist[rows, first], np.inf)
+
+        missing = np.flatnonzero(~found)
+        if len(missing) and len(sites):
+            dist, idx = SiteIndex(self.index.sites[sites]).nearest(self.demand[missing], 1)
+            assignment[missing] = sites[idx[:, 0]]
+            distance[missing] = dist[:, 0]
+
+        return {
+            'assignment': assignment,
+            'distance': distance,
+            'weighted_distance': float(self.weights @ distance),
+            'served_demand': None if radius_km is None else float(self.weights[distance <= radius_km].sum()),
+        }
@@ -81,4 +81,7 @@ plt.margins(x=0.05, y=0.1)
 plt.tight_layout()
 plt.savefig('Tibet_Charging_Pile_Interpolation.png', 
            dpi=300, bbox_inches='tight', transparent=False)
-plt.show()
\ No newline at end of file
+# 无界面（Agg 后端，如 MPLBACKEND=Agg）时只保存不弹窗
+if matplotlib.get_backend().lower() != 'agg':
+    plt.show()
+plt.close()
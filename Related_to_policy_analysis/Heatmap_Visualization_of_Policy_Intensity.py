@@ -101,7 +101,10 @@ def generate_heatmap(data):
     output_path = os.path.join(os.path.dirname(__file__), "policy_heatmap.png")
     plt.savefig(output_path, dpi=300, bbox_inches='tight')
     print(f"热力图已保存至: {output_path}")
-    plt.show()
+    # Headless (Agg backend, e.g. MPLBACKEND=Agg): save only, no window
+    if plt.get_backend().lower() != 'agg':
+        plt.show()
+    plt.close()
 
 if __name__ == "__main__":
     # Load data